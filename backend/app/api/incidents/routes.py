@@ -4,9 +4,9 @@ Handles CRUD operations, real-time communication, and file attachments
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, WebSocket, WebSocketDisconnect
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
-import json
+import orjson
 
 from app.models.incident import IncidentResponse, IncidentCreate, IncidentUpdate, IncidentStatus
 from app.models.message import Message, MessageCreate
@@ -34,13 +34,19 @@ class ConnectionManager:
         if user_id in self.user_connections:
             del self.user_connections[user_id]
 
-    async def broadcast(self, message: str):
+    @staticmethod
+    def _prepare_payload(message: Union[str, dict]) -> str:
+        # Serialize once with orjson; text frames keep existing clients working
+        return message if isinstance(message, str) else orjson.dumps(message, default=str).decode()
+
+    async def broadcast(self, message: Union[str, dict]):
+        payload = self._prepare_payload(message)
         for connection in self.active_connections:
-            await connection.send_text(message)
+            await connection.send_text(payload)
 
-    async def send_to_user(self, user_id: str, message: str):
+    async def send_to_user(self, user_id: str, message: Union[str, dict]):
         if user_id in self.user_connections:
-            await self.user_connections[user_id].send_text(message)
+            await self.user_connections[user_id].send_text(self._prepare_payload(message))
 
 manager = ConnectionManager()
 
@@ -72,13 +78,13 @@ async def create_incident(
         )
         
         # Broadcast real-time notification to security team
-        await manager.broadcast(json.dumps({
+        await manager.broadcast({
             "type": "new_incident",
             "incident_id": incident.id,
             "title": incident.title,
             "severity": incident.severity.value,
             "reporter": current_user.full_name
-        }))
+        })
         
         return incident
         
@@ -386,12 +392,12 @@ async def update_incident(
         )
         
         # Broadcast real-time update
-        await manager.broadcast(json.dumps({
+        await manager.broadcast({
             "type": "incident_updated",
             "incident_id": incident_id,
             "status": updated_incident.get("status", "unknown"),
             "updated_by": current_user.full_name
-        }))
+        })
         
         return updated_incident
         
@@ -480,12 +486,12 @@ async def assign_incident(
                 print(f"Warning: Could not create conversation for incident {incident_id}: {e}")
         
         # Send real-time notification to assignee
-        await manager.send_to_user(assignee_id, json.dumps({
+        await manager.send_to_user(assignee_id, {
             "type": "incident_assigned",
             "incident_id": incident_id,
             "title": incident.get("title", "Untitled Incident"),
             "assigned_by": current_user.full_name
-        }))
+        })
         
         return {"message": "Incident assigned successfully"}
         
@@ -561,13 +567,13 @@ async def send_message(
         )
         
         # Broadcast real-time message
-        await manager.broadcast(json.dumps({
+        await manager.broadcast({
             "type": "new_message",
             "incident_id": incident_id,
             "message_id": message.id,
             "sender": current_user.full_name,
             "content": message_data.content
-        }))
+        })
         
         return message
         
@@ -615,6 +621,65 @@ async def get_messages(
             detail=f"Failed to retrieve messages: {str(e)}"
         )
 
+@router.get("/{incident_id}/messages/unread-count")
+async def get_unread_message_count(
+    incident_id: str,
+    current_user: User = Depends(get_current_user),
+    messaging_service: MessagingService = Depends()
+):
+    """
+    Get the number of unread messages from other participants in an incident
+    """
+    try:
+        if current_user.role.value == "employee":
+            incident = await IncidentService().get_incident(incident_id)
+            if not incident:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Incident not found"
+                )
+            if incident.get('reporter_id') != current_user.uid:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Access denied to incident messages"
+                )
+
+        count = await messaging_service.get_unread_count(incident_id, current_user.uid)
+        return {"incident_id": incident_id, "unread_count": count}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve unread count: {str(e)}"
+        )
+
+@router.post("/{incident_id}/messages/{message_id}/read")
+async def mark_message_read(
+    incident_id: str,
+    message_id: str,
+    current_user: User = Depends(get_current_user),
+    messaging_service: MessagingService = Depends()
+):
+    """
+    Mark an incident message as read
+    """
+    if current_user.role.value == "employee":
+        incident = await IncidentService().get_incident(incident_id)
+        if not incident or incident.get('reporter_id') != current_user.uid:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Access denied to incident messages"
+            )
+
+    if not await messaging_service.mark_message_read(message_id, current_user.uid, incident_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Message not found"
+        )
+    return {"message": "Message marked as read"}
+
 @router.post("/{incident_id}/attachments")
 async def upload_attachment(
     incident_id: str,
@@ -705,11 +770,11 @@ async def resolve_incident(
         )
         
         # Broadcast real-time update
-        await manager.broadcast(json.dumps({
+        await manager.broadcast({
             "type": "incident_resolved",
             "incident_id": incident_id,
             "resolved_by": current_user.full_name
-        }))
+        })
         
         return {"message": "Incident marked as resolved successfully"}
         
@@ -6,7 +6,7 @@ Handles conversations, real-time messaging, and WebSocket connections
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status, Query, Depends
 from firebase_admin import auth
 from typing import Optional, List
-import json
+import orjson
 import time
 from collections import defaultdict
 
@@ -34,6 +34,8 @@ async def get_conversations(
     conversation_type: Optional[ConversationType] = None,
     limit: int = 20,
     offset: int = 0,
+    include_participants: bool = True,
+    include_incident_details: bool = True,
     current_user: User = Depends(get_current_user),
     conversation_service: ConversationService = Depends()
 ):
@@ -44,7 +46,9 @@ async def get_conversations(
             current_user.role.value,
             conversation_type,
             limit,
-            offset
+            offset,
+            include_participants=include_participants,
+            include_incident_details=include_incident_details
         )
 
         return {
@@ -94,10 +98,15 @@ async def create_conversation(
 @router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: str,
+    fields: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     conversation_service: ConversationService = Depends()
 ):
-    """Get specific conversation details"""
+    """Get specific conversation details
+
+    Pass a comma-separated `fields` list (e.g. "title,conversation_type,incident_id")
+    when only conversation metadata is needed; participants are then left empty.
+    """
     try:
         # Check permissions
         has_permission = await conversation_service.check_user_permission(
@@ -113,7 +122,8 @@ async def get_conversation(
                 detail="Access denied to this conversation"
             )
         
-        conversation = await conversation_service.get_conversation(conversation_id)
+        requested_fields = {field.strip() for field in fields.split(',') if field.strip()} if fields else None
+        conversation = await conversation_service.get_conversation(conversation_id, fields=requested_fields)
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -188,7 +198,7 @@ async def get_incident_conversation(
             )
         else:
             # Quick participant check - no need to reload full conversation
-            is_participant = any(p.user_id == current_user.uid for p in conversation.participants)
+            is_participant = conversation.has_participant(current_user.uid)
 
             if not is_participant:
                 if current_user.role.value == "security_team" or current_user.uid == reporter_id:
@@ -266,7 +276,7 @@ async def send_message_to_conversation(
             "is_read": message.is_read
         }
         
-        await manager.broadcast_to_room(f"conversation_{conversation_id}", json.dumps({
+        await manager.broadcast_to_room(f"conversation_{conversation_id}", {
             "type": "incident_message",
             "conversation_id": conversation_id,
             "incident_id": conversation_id,  # For backward compatibility
@@ -274,7 +284,7 @@ async def send_message_to_conversation(
             "sender": current_user.full_name,
             "user_id": current_user.uid,
             "timestamp": message.created_at.isoformat() if hasattr(message.created_at, 'isoformat') else str(message.created_at)
-        }))
+        })
         
         return {"message": "Message sent successfully", "message_id": message.id}
     except HTTPException:
@@ -389,10 +399,10 @@ async def test_websocket_connection():
     return {
         "status": "WebSocket service is running",
         "active_connections": len(manager.active_connections),
-        "room_connections": len(manager.room_connections),
+        "room_connections": len(manager.room_members),
         "connection_details": {
             "active_users": list(manager.active_connections.keys()),
-            "rooms": list(manager.room_connections.keys())
+            "rooms": list(manager.room_members.keys())
         },
         "recent_connection_attempts": {
             user_id: {
@@ -522,7 +532,7 @@ async def websocket_general_endpoint(websocket: WebSocket, token: str = Query(..
             'user_id': user_id,
             'token_expires_in': user_data.get('expires_in', 0)
         }
-        await websocket.send_text(json.dumps(welcome_message))
+        await websocket.send_text(orjson.dumps(welcome_message).decode())
         print(f"DEBUG: Sent welcome message to {user_id}")
     except Exception as e:
         print(f"Failed to send welcome message: {str(e)}")
@@ -533,38 +543,38 @@ async def websocket_general_endpoint(websocket: WebSocket, token: str = Query(..
             data = await websocket.receive_text()
             print(f"DEBUG: Received WebSocket message from {user_id}: {data[:100]}")
             try:
-                message_data = json.loads(data)
+                message_data = orjson.loads(data)
                 
                 # Handle ping/pong for connection health
                 if message_data.get('type') == 'ping':
-                    await websocket.send_text(json.dumps({
+                    await websocket.send_text(orjson.dumps({
                         'type': 'pong',
                         'timestamp': message_data.get('timestamp'),
                         'token_expires_in': user_data.get('expires_in', 0)
-                    }))
+                    }).decode())
                     continue
                 
                 # Handle token refresh requests
                 if message_data.get('type') == 'token_refresh':
-                    await websocket.send_text(json.dumps({
+                    await websocket.send_text(orjson.dumps({
                         'type': 'token_refresh_required',
                         'message': 'Please refresh your authentication token and reconnect'
-                    }))
+                    }).decode())
                     continue
                 
                 # Broadcast message to all connected users
-                await manager.broadcast(json.dumps({
+                await manager.broadcast({
                     'type': 'message',
                     'user_id': user_id,
                     'message': message_data,
                     'timestamp': message_data.get('timestamp')
-                }))
-            except json.JSONDecodeError:
+                })
+            except orjson.JSONDecodeError:
                 # Handle invalid JSON
-                await websocket.send_text(json.dumps({
+                await websocket.send_text(orjson.dumps({
                     'type': 'error',
                     'message': 'Invalid message format'
-                }))
+                }).decode())
             
     except WebSocketDisconnect:
         print(f"DEBUG: WebSocket disconnect for user {user_id}")
@@ -600,7 +610,7 @@ async def websocket_conversation_endpoint(websocket: WebSocket, conversation_id:
             'conversation_id': conversation_id,
             'user_id': user_id
         }
-        await websocket.send_text(json.dumps(welcome_message))
+        await websocket.send_text(orjson.dumps(welcome_message).decode())
     except Exception as e:
         print(f"Failed to send welcome message: {str(e)}")
     
@@ -609,25 +619,25 @@ async def websocket_conversation_endpoint(websocket: WebSocket, conversation_id:
             # Keep connection alive and handle incoming messages
             data = await websocket.receive_text()
             try:
-                message_data = json.loads(data)
+                message_data = orjson.loads(data)
                 
                 # Handle room join requests
                 if message_data.get('type') == 'join_room':
                     requested_room = message_data.get('room_id')
                     if requested_room == room_id:
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(orjson.dumps({
                             'type': 'room_joined',
                             'room_id': room_id,
                             'message': f'Successfully joined {room_id}'
-                        }))
+                        }).decode())
                     continue
                 
                 # Handle ping/pong for connection health
                 if message_data.get('type') == 'ping':
-                    await websocket.send_text(json.dumps({
+                    await websocket.send_text(orjson.dumps({
                         'type': 'pong',
                         'timestamp': message_data.get('timestamp')
-                    }))
+                    }).decode())
                     continue
                 
                 # Handle direct WebSocket messages - extract the message content
@@ -663,13 +673,13 @@ async def websocket_conversation_endpoint(websocket: WebSocket, conversation_id:
                         'timestamp': message_data.get('timestamp')
                     }
                 
-                await manager.broadcast_to_room(room_id, json.dumps(broadcast_data))
-            except json.JSONDecodeError:
+                await manager.broadcast_to_room(room_id, broadcast_data)
+            except orjson.JSONDecodeError:
                 # Handle invalid JSON
-                await websocket.send_text(json.dumps({
+                await websocket.send_text(orjson.dumps({
                     'type': 'error',
                     'message': 'Invalid message format'
-                }))
+                }).decode())
             
     except WebSocketDisconnect:
         print(f"WebSocket disconnect for user {user_id} from conversation {conversation_id}")
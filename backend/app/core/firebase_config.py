@@ -1,5 +1,5 @@
 import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import credentials, firestore, firestore_async, auth
 import os
 from dotenv import load_dotenv
 from typing import Optional
@@ -8,6 +8,8 @@ load_dotenv()
 
 class FirebaseConfig:
     _db = None
+    _async_db = None
+    _async_collections = {}
     _app = None
     
     @classmethod
@@ -50,6 +52,22 @@ class FirebaseConfig:
             return cls.initialize_firebase()
         return cls._db
     
+    @classmethod
+    def get_async_firestore(cls):
+        """Get the native async Firestore client (shares the default app)"""
+        if cls._async_db is None:
+            if not firebase_admin._apps:
+                cls.initialize_firebase()
+            cls._async_db = firestore_async.client()
+        return cls._async_db
+
+    @classmethod
+    def get_async_collection(cls, name: str):
+        """Get a cached async collection reference, shared across requests"""
+        if name not in cls._async_collections:
+            cls._async_collections[name] = cls.get_async_firestore().collection(name)
+        return cls._async_collections[name]
+    
     @classmethod
     def verify_id_token(cls, id_token: str) -> Optional[dict]:
         """Verify Firebase ID token and return user data"""
@@ -19,6 +19,7 @@ from app.api.user_activity import routes as user_activity_routes
 from app.api.chatbot import routes as chatbot_routes
 from app.core.firebase_config import FirebaseConfig
 from app.services.background.background_tasks import background_service
+from app.services.notifications.notification_service import close_http_session
 
 # Load environment variables
 load_dotenv()
@@ -63,6 +64,8 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     await background_service.stop_background_tasks()
+    await messaging_routes.manager.stop()
+    await close_http_session()
 
 @app.get("/")
 async def root():
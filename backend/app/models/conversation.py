@@ -3,8 +3,8 @@ Conversation Models - Enhanced Chat System
 Handles different types of conversations: incident-specific and team internal
 """
 
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Optional, List, Dict, Any, Set
 from datetime import datetime
 from .common import MessageType
 from enum import Enum
@@ -70,6 +70,16 @@ class ConversationResponse(BaseModel):
     archived_at: Optional[datetime] = None
     archived_by: Optional[str] = None
 
+    # Participant ids as a set for O(1) membership checks on the chat hot path
+    _participant_id_set: Set[str] = PrivateAttr(default_factory=set)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._participant_id_set = {p.user_id for p in self.participants}
+
+    def has_participant(self, user_id: str) -> bool:
+        """Check whether a user is an active participant"""
+        return user_id in self._participant_id_set
+
 class ConversationUpdate(BaseModel):
     """Model for updating conversations"""
     title: Optional[str] = None
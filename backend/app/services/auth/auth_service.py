@@ -11,6 +11,7 @@ from app.models.user import User
 from app.models.common import UserRole
 from app.models.auth import UserProfile
 from app.core.firebase_config import FirebaseConfig
+from app.utils.user_cache import invalidate_user_cache
 from app.services.user_activity.activity_service import UserActivityService
 from app.models.user_activity import ActivityType
 
@@ -76,6 +77,7 @@ class AuthService:
         }
         
         self.users_collection.document(uid).update(update_data)
+        invalidate_user_cache(uid)
         return await self.get_user_profile(uid)
 
     async def update_user_profile_fields(self, uid: str, update_data: dict) -> User:
@@ -84,6 +86,7 @@ class AuthService:
         update_data['updated_at'] = datetime.utcnow()
         
         self.users_collection.document(uid).update(update_data)
+        invalidate_user_cache(uid)
         return await self.get_user_profile(uid)
 
     async def assign_security_role(self, uid: str) -> bool:
@@ -93,6 +96,7 @@ class AuthService:
                 'role': UserRole.SECURITY_TEAM.value,
                 'updated_at': datetime.utcnow()
             })
+            invalidate_user_cache(uid)
             return True
         except Exception:
             return False
@@ -104,6 +108,7 @@ class AuthService:
                 'role': UserRole.EMPLOYEE.value,
                 'updated_at': datetime.utcnow()
             })
+            invalidate_user_cache(uid)
             return True
         except Exception:
             return False
@@ -5,7 +5,7 @@ Background Tasks Service - Scheduled maintenance tasks
 import asyncio
 import logging
 from datetime import datetime
-from app.services.user_activity.activity_service import UserActivityService
+from app.services.user_activity.activity_service import UserActivityService, flush_pending_activities, ACTIVITY_RETENTION_DAYS
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +32,7 @@ class BackgroundTaskService:
         """Stop all background tasks"""
         self.running = False
         logger.info("Stopping background tasks...")
+        await flush_pending_activities()
     
     async def offline_user_updater(self):
         """Periodically update offline users (runs every 5 minutes)"""
@@ -52,7 +53,7 @@ class BackgroundTaskService:
                 now = datetime.now()
                 # Run at 2 AM
                 if now.hour == 2 and now.minute < 5:
-                    await self.activity_service.cleanup_old_activities(days_to_keep=30)
+                    await self.activity_service.cleanup_old_activities(days_to_keep=ACTIVITY_RETENTION_DAYS)
                     logger.info("Cleaned up old activity records")
                     
                     # Sleep for 1 hour to avoid running multiple times
@@ -4,7 +4,7 @@ Handles CRUD operations for security incidents
 """
 
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
 import asyncio
 from functools import lru_cache
@@ -48,11 +48,22 @@ class IncidentCache:
 # Global cache instance
 _incident_cache = IncidentCache(ttl_seconds=30)
 
+# Assignee display names rarely change, so they can be cached for longer
+_assignee_name_cache = IncidentCache(ttl_seconds=300)
+
+# Field projections for lightweight dashboard queries
+_DASHBOARD_FIELDS = [
+    'id', 'title', 'status', 'severity', 'incident_type',
+    'reporter_name', 'assigned_to_name', 'created_at', 'updated_at'
+]
+_STATS_FIELDS = ['status', 'severity']
+_NORMALIZED_FIELDS = ('status', 'severity', 'incident_type')
+
 
 class IncidentService:
     def __init__(self):
-        self.db = FirebaseConfig.get_firestore()
-        self.incidents_collection = self.db.collection('incidents')
+        self.incidents_collection = FirebaseConfig.get_async_collection('incidents')
+        self.db = FirebaseConfig.get_async_firestore()
         self.file_service = FileService()
         self.cache = _incident_cache
 
@@ -64,14 +75,14 @@ class IncidentService:
         attachments_map = {}
         try:
             # Fetch all attachments in one query
-            files_collection = self.db.collection('file_attachments')
-            all_files = list(files_collection.where('incident_id', 'in', incident_ids[:10]).stream())
+            files_collection = FirebaseConfig.get_async_collection('file_attachments')
+            all_files = [doc async for doc in files_collection.where('incident_id', 'in', incident_ids[:10]).stream()]
 
             # If more than 10 incidents, batch the queries (Firestore 'in' limit is 10)
             if len(incident_ids) > 10:
                 for i in range(10, len(incident_ids), 10):
                     batch_ids = incident_ids[i:i+10]
-                    batch_files = list(files_collection.where('incident_id', 'in', batch_ids).stream())
+                    batch_files = [doc async for doc in files_collection.where('incident_id', 'in', batch_ids).stream()]
                     all_files.extend(batch_files)
 
             # Group by incident_id
@@ -95,6 +106,33 @@ class IncidentService:
 
         return attachments_map
 
+    async def _batch_get_user_names(self, user_ids: List[str]) -> Dict[str, str]:
+        """Resolve user full names, reading uncached users in one get_all round trip"""
+        names = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = _assignee_name_cache.get(user_id)
+            if cached is not None:
+                names[user_id] = cached
+            else:
+                missing.append(user_id)
+
+        if not missing:
+            return names
+
+        try:
+            users_collection = FirebaseConfig.get_async_collection('users')
+            refs = [users_collection.document(user_id) for user_id in missing]
+            async for doc in self.db.get_all(refs):
+                if doc.exists:
+                    name = doc.to_dict().get('full_name', 'Unknown User')
+                    names[doc.id] = name
+                    _assignee_name_cache.set(doc.id, name)
+        except Exception as e:
+            print(f"Warning: Could not get assignee names: {e}")
+
+        return names
+
     async def create_incident(
         self, 
         incident_data: IncidentCreate, 
@@ -134,7 +172,7 @@ class IncidentService:
             'priority_score': None
         }
         
-        self.incidents_collection.document(incident_id).set(incident_doc)
+        await self.incidents_collection.document(incident_id).set(incident_doc)
         
         # Convert string values back to enums for the response
         response_data = incident_doc.copy()
@@ -186,13 +224,13 @@ class IncidentService:
             'priority_score': None
         }
 
-        self.incidents_collection.document(incident_id).set(incident_doc)
+        await self.incidents_collection.document(incident_id).set(incident_doc)
 
         return IncidentResponse(**incident_doc)
 
     async def get_incident(self, incident_id: str) -> Optional[dict]:
         """Get incident by ID with attachments"""
-        doc = self.incidents_collection.document(incident_id).get()
+        doc = await self.incidents_collection.document(incident_id).get()
         
         if not doc.exists:
             return None
@@ -265,16 +303,16 @@ class IncidentService:
                 # If there's a status filter, try to use it (might require simple index)
                 try:
                     base_query = self.incidents_collection.where('status', '==', status_filter.value).order_by('created_at', direction='DESCENDING')
-                    all_docs = list(base_query.stream())
+                    all_docs = [doc async for doc in base_query.stream()]
                 except Exception as e:
                     print(f"Status filter query failed, falling back to get all: {e}")
                     # Fallback: get all incidents and filter in memory
                     base_query = self.incidents_collection.order_by('created_at', direction='DESCENDING')
-                    all_docs = list(base_query.stream())
+                    all_docs = [doc async for doc in base_query.stream()]
             else:
                 # No status filter, just get all incidents
                 base_query = self.incidents_collection.order_by('created_at', direction='DESCENDING')
-                all_docs = list(base_query.stream())
+                all_docs = [doc async for doc in base_query.stream()]
         except Exception as e:
             print(f"Error fetching all incidents: {str(e)}")
             import traceback
@@ -461,7 +499,7 @@ class IncidentService:
         try:
             # Simple query without ordering to avoid index issues
             query = self.incidents_collection.where('reporter_id', '==', user_id)
-            all_docs = list(query.stream())
+            all_docs = [doc async for doc in query.stream()]
             
             # Sort by created_at in descending order
             from datetime import datetime
@@ -628,8 +666,9 @@ class IncidentService:
         updated_by: str
     ) -> IncidentResponse:
         """Update incident details"""
+        now = datetime.now(timezone.utc)
         update_data = {
-            'updated_at': datetime.utcnow(),
+            'updated_at': now,
             'updated_by': updated_by
         }
         
@@ -642,12 +681,12 @@ class IncidentService:
         if incident_data.status:
             update_data['status'] = incident_data.status.value
             if incident_data.status in [IncidentStatus.RESOLVED, IncidentStatus.CLOSED]:
-                update_data['resolved_at'] = datetime.utcnow()
+                update_data['resolved_at'] = now
                 update_data['resolved_by'] = updated_by
         if incident_data.assigned_to:
             update_data['assigned_to'] = incident_data.assigned_to
         
-        self.incidents_collection.document(incident_id).update(update_data)
+        await self.incidents_collection.document(incident_id).update(update_data)
         
         return await self.get_incident(incident_id)
 
@@ -660,26 +699,20 @@ class IncidentService:
         """Assign incident to security team member"""
         
         # Get assignee information from users collection
-        assignee_name = "Unknown User"
-        try:
-            users_collection = self.db.collection('users')
-            assignee_doc = users_collection.document(assignee_id).get()
-            if assignee_doc.exists:
-                assignee_data = assignee_doc.to_dict()
-                assignee_name = assignee_data.get('full_name', 'Unknown User')
-        except Exception as e:
-            print(f"Warning: Could not get assignee name: {e}")
+        names = await self._batch_get_user_names([assignee_id])
+        assignee_name = names.get(assignee_id, "Unknown User")
         
+        now = datetime.now(timezone.utc)
         update_data = {
             'assigned_to': assignee_id,
             'assigned_to_name': assignee_name,
-            'assigned_at': datetime.utcnow(),
+            'assigned_at': now,
             'status': IncidentStatus.INVESTIGATING.value,
-            'updated_at': datetime.utcnow(),
+            'updated_at': now,
             'assigned_by': assigned_by
         }
         
-        self.incidents_collection.document(incident_id).update(update_data)
+        await self.incidents_collection.document(incident_id).update(update_data)
         
         return await self.get_incident(incident_id)
 
@@ -689,17 +722,18 @@ class IncidentService:
         unassigned_by: str
     ) -> IncidentResponse:
         """Unassign incident (remove assignee)"""
+        now = datetime.now(timezone.utc)
         update_data = {
             'assigned_to': None,
             'assigned_to_name': None,
             'assigned_at': None,
             'status': IncidentStatus.PENDING.value,
-            'updated_at': datetime.utcnow(),
+            'updated_at': now,
             'unassigned_by': unassigned_by,
-            'unassigned_at': datetime.utcnow()
+            'unassigned_at': now
         }
         
-        self.incidents_collection.document(incident_id).update(update_data)
+        await self.incidents_collection.document(incident_id).update(update_data)
         
         return await self.get_incident(incident_id)
 
@@ -714,13 +748,13 @@ class IncidentService:
         update_data = {
             'ai_category': ai_category,
             'ai_confidence': ai_confidence,
-            'updated_at': datetime.utcnow()
+            'updated_at': datetime.now(timezone.utc)
         }
 
         if suggested_severity:
             update_data['severity'] = suggested_severity.value
 
-        self.incidents_collection.document(incident_id).update(update_data)
+        await self.incidents_collection.document(incident_id).update(update_data)
 
         return await self.get_incident(incident_id)
 
@@ -736,40 +770,30 @@ class IncidentService:
             return cached
 
         try:
-            # Get only limited recent incidents
-            query = self.incidents_collection.order_by(
+            # Get only limited recent incidents, projecting just the dashboard
+            # fields so attachments/descriptions never leave Firestore
+            query = self.incidents_collection.select(
+                _DASHBOARD_FIELDS
+            ).order_by(
                 'created_at', direction='DESCENDING'
             ).limit(limit)
 
-            docs = list(query.stream())
+            docs = [doc async for doc in query.stream()]
             incidents = []
 
             for doc in docs:
                 data = doc.to_dict()
 
+                # Return minimal data for dashboard (no attachments)
+                incident = {field: data.get(field) for field in _DASHBOARD_FIELDS}
+
                 # Fast enum conversion
-                try:
-                    if data.get('status') and isinstance(data['status'], str):
-                        data['status'] = data['status'].lower()
-                    if data.get('severity') and isinstance(data['severity'], str):
-                        data['severity'] = data['severity'].lower()
-                    if data.get('incident_type') and isinstance(data['incident_type'], str):
-                        data['incident_type'] = data['incident_type'].lower()
-                except:
-                    pass
+                for field in _NORMALIZED_FIELDS:
+                    value = incident[field]
+                    if isinstance(value, str):
+                        incident[field] = value.lower()
 
-                # Return minimal data for dashboard (no attachments)
-                incidents.append({
-                    'id': data.get('id'),
-                    'title': data.get('title'),
-                    'status': data.get('status'),
-                    'severity': data.get('severity'),
-                    'incident_type': data.get('incident_type'),
-                    'reporter_name': data.get('reporter_name'),
-                    'assigned_to_name': data.get('assigned_to_name'),
-                    'created_at': data.get('created_at'),
-                    'updated_at': data.get('updated_at')
-                })
+                incidents.append(incident)
 
             # Cache for 30 seconds
             self.cache.set(cache_key, incidents)
@@ -790,8 +814,8 @@ class IncidentService:
             return cached
 
         try:
-            # Get all incidents (but only count them, don't process)
-            all_docs = list(self.incidents_collection.stream())
+            # Get all incidents, but only the fields we count on
+            all_docs = [doc async for doc in self.incidents_collection.select(_STATS_FIELDS).stream()]
 
             stats = {
                 'total': len(all_docs),
@@ -849,7 +873,7 @@ class IncidentService:
                 'assigned_to', '==', user_id
             ).limit(limit * 2)  # Get more to account for filtering
 
-            docs = list(query.stream())
+            docs = [doc async for doc in query.stream()]
             incidents = []
 
             for doc in docs:
@@ -879,26 +903,43 @@ class IncidentService:
             print(f"Error getting assigned incidents: {e}")
             return []
 
+    async def _query_resolved_by_field(self, field: str, user_id: str, limit: int) -> List[Any]:
+        """Fetch a user's resolved/closed incidents matched on a single user field"""
+        query = self.incidents_collection.where(
+            field, '==', user_id
+        ).where(
+            'status', 'in', ['resolved', 'closed']
+        )
+        try:
+            return [doc async for doc in query.order_by('resolved_at', direction='DESCENDING').limit(limit).stream()]
+        except Exception as e:
+            if "index" not in str(e).lower():
+                raise
+            # Fallback: unordered query until the composite index exists
+            print(f"Warning: Using fallback resolved incidents query on {field} due to missing index")
+            return [doc async for doc in query.limit(limit).stream()]
+
     async def get_resolved_incidents_fast(self, user_id: str, limit: int = 20) -> List[Dict]:
         """
         FAST: Get resolved incidents for a user without N+1 queries
         """
         try:
-            # Query resolved incidents (no order_by to avoid index requirement)
-            query = self.incidents_collection.where(
-                'status', 'in', ['resolved', 'closed']
-            ).limit(limit * 3)  # Get more to account for filtering
+            # Query assigned_to and resolved_by in parallel so Firestore only
+            # returns this user's incidents instead of filtering in Python
+            assigned_docs, resolver_docs = await asyncio.gather(
+                self._query_resolved_by_field('assigned_to', user_id, limit),
+                self._query_resolved_by_field('resolved_by', user_id, limit)
+            )
+
+            # Deduplicate incidents matching both queries
+            docs = {doc.id: doc for doc in assigned_docs}
+            docs.update((doc.id, doc) for doc in resolver_docs)
 
-            docs = list(query.stream())
             incidents = []
 
-            for doc in docs:
+            for doc in docs.values():
                 data = doc.to_dict()
 
-                # Filter by user (assigned_to or resolved_by)
-                if data.get('assigned_to') != user_id and data.get('resolved_by') != user_id:
-                    continue
-
                 incidents.append({
                     'id': data.get('id'),
                     'title': data.get('title'),
@@ -913,9 +954,9 @@ class IncidentService:
                 })
 
             # Sort by resolved_at in Python
-            incidents.sort(key=lambda x: x.get('resolved_at', ''), reverse=True)
+            incidents.sort(key=lambda x: x.get('resolved_at') or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
             return incidents[:limit]
 
         except Exception as e:
             print(f"Error getting resolved incidents: {e}")
-            return []
\ No newline at end of file
+            return []
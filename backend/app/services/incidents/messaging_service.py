@@ -3,11 +3,14 @@ Messaging Service - Jayasanka's Module
 Handles secure messaging for incident communication
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Set, Tuple
+from collections import defaultdict
 from datetime import datetime
 from uuid import uuid4
 import time
 
+from firebase_admin import firestore
+
 from app.models.message import Message, MessageType
 from app.core.firebase_config import FirebaseConfig
 
@@ -15,34 +18,61 @@ from app.core.firebase_config import FirebaseConfig
 # PERFORMANCE: Simple cache for unread counts
 class UnreadCountCache:
     def __init__(self, ttl_seconds: int = 30):
-        self._cache: Dict[str, int] = {}
-        self._timestamps: Dict[str, float] = {}
+        # {(incident_id, user_id): (count, expires_at)} on the monotonic clock
+        self._data: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        # {incident_id: {user_id}} so invalidation only touches one incident
+        self._by_incident: Dict[str, Set[str]] = defaultdict(set)
         self._ttl = ttl_seconds
 
-    def get(self, key: str) -> Optional[int]:
-        if key in self._cache and time.time() - self._timestamps[key] < self._ttl:
-            return self._cache[key]
+    def get(self, incident_id: str, user_id: str) -> Optional[int]:
+        entry = self._data.get((incident_id, user_id))
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
         return None
 
-    def set(self, key: str, value: int):
-        self._cache[key] = value
-        self._timestamps[key] = time.time()
+    def set(self, incident_id: str, user_id: str, value: int):
+        self._data[(incident_id, user_id)] = (value, time.monotonic() + self._ttl)
+        self._by_incident[incident_id].add(user_id)
 
     def invalidate(self, incident_id: str):
         # Invalidate all cached counts for an incident
-        keys_to_delete = [k for k in self._cache.keys() if k.startswith(f"{incident_id}_")]
-        for key in keys_to_delete:
-            self._cache.pop(key, None)
-            self._timestamps.pop(key, None)
+        for user_id in self._by_incident.pop(incident_id, ()):
+            self._data.pop((incident_id, user_id), None)
 
 
 _unread_cache = UnreadCountCache(ttl_seconds=30)
 
 
+# Stored value -> enum member, so trusted documents skip the enum constructor
+_MESSAGE_TYPES = {member.value: member for member in MessageType}
+_REQUIRED_MESSAGE_FIELDS = ('id', 'incident_id', 'sender_id', 'sender_name', 'sender_role', 'content', 'created_at')
+
+
+def _message_from_doc(data: Dict[str, Any]) -> Message:
+    """Build a Message from a stored document, skipping validation when it already matches the schema"""
+    message_type = _MESSAGE_TYPES.get(data.get('message_type'))
+    if (
+        message_type is None
+        or data.get('attachments')  # nested models need validating
+        or not isinstance(data.get('read_by', []), list)  # older reads stored a bare user id
+        or not isinstance(data.get('metadata', {}), dict)
+        or any(data.get(field) is None for field in _REQUIRED_MESSAGE_FIELDS)
+    ):
+        return Message.model_validate(data)
+    return Message.model_construct(**{**data, 'message_type': message_type})
+
+
+def _unread_path(sender_id: str) -> str:
+    """Field path of one sender's entry in a message_counters document"""
+    return firestore.FieldPath('unread_by_sender', sender_id).to_api_repr()
+
+
 class MessagingService:
     def __init__(self):
-        self.db = FirebaseConfig.get_firestore()
-        self.messages_collection = self.db.collection('messages')
+        self.messages_collection = FirebaseConfig.get_async_collection('messages')
+        # message_counters/{incident_id}: {'unread_by_sender': {sender_id: count}}
+        self.counters_collection = FirebaseConfig.get_async_collection('message_counters')
+        self.db = FirebaseConfig.get_async_firestore()
 
     async def send_message(
         self,
@@ -82,37 +112,49 @@ class MessagingService:
             'deleted_at': None
         }
         
-        self.messages_collection.document(message_id).set(message_doc)
+        message_ref = self.messages_collection.document(message_id)
+        counter_ref = self.counters_collection.document(incident_id)
+
+        # PERFORMANCE: Write the message and bump the sender's unread counter in one
+        # transaction, so get_unread_count can read a single document
+        @firestore.async_transactional
+        async def write_message(transaction):
+            counter_doc = await counter_ref.get(transaction=transaction)
+            if counter_doc.exists:
+                transaction.update(counter_ref, {_unread_path(sender_id): firestore.Increment(1)})
+            else:
+                # First counted message: seed from the messages already stored
+                unread_by_sender = await self._count_unread_by_sender(incident_id, transaction)
+                unread_by_sender[sender_id] = unread_by_sender.get(sender_id, 0) + 1
+                transaction.set(counter_ref, {'incident_id': incident_id, 'unread_by_sender': unread_by_sender})
+            transaction.set(message_ref, message_doc)
+
+        await write_message(self.db.transaction())
 
         # PERFORMANCE: Invalidate unread count cache for this incident
         _unread_cache.invalidate(incident_id)
 
         return Message(**message_doc)
 
+    async def iter_incident_messages(self, incident_id: str) -> AsyncIterator[Message]:
+        """Yield messages for an incident as Firestore streams them"""
+        query = self.messages_collection.where('incident_id', '==', incident_id).order_by('created_at')
+        async for doc in query.stream():
+            yield _message_from_doc(doc.to_dict())
+
     async def get_incident_messages(self, incident_id: str) -> List[Message]:
         """Get all messages for an incident"""
         try:
             # First try with ordering
-            query = self.messages_collection.where('incident_id', '==', incident_id).order_by('created_at')
-            docs = query.stream()
-            
-            messages = []
-            for doc in docs:
-                data = doc.to_dict()
-                messages.append(Message(**data))
-            
-            return messages
+            return [message async for message in self.iter_incident_messages(incident_id)]
         except Exception as e:
             if "index" in str(e).lower():
                 # Fallback: get messages without ordering
                 print(f"Warning: Using fallback query for incident {incident_id} due to missing index")
                 query = self.messages_collection.where('incident_id', '==', incident_id)
-                docs = query.stream()
-                
                 messages = []
-                for doc in docs:
-                    data = doc.to_dict()
-                    messages.append(Message(**data))
+                async for doc in query.stream():
+                    messages.append(_message_from_doc(doc.to_dict()))
                 
                 # Sort in Python instead of Firestore
                 messages.sort(key=lambda x: x.created_at if x.created_at else datetime.min)
@@ -120,42 +162,81 @@ class MessagingService:
             else:
                 raise e
 
-    async def mark_message_read(self, message_id: str, user_id: str) -> bool:
-        """Mark message as read by user"""
-        try:
-            # Get message to find incident_id for cache invalidation
-            doc = self.messages_collection.document(message_id).get()
-            if doc.exists:
-                incident_id = doc.to_dict().get('incident_id')
-
-            self.messages_collection.document(message_id).update({
+    async def mark_message_read(self, message_id: str, user_id: str, incident_id: Optional[str] = None) -> bool:
+        """Mark message as read by user; when incident_id is given the message must belong to it"""
+        message_ref = self.messages_collection.document(message_id)
+
+        # Read and decrement in one transaction, so concurrent reads of the
+        # same message only take it out of the unread counter once
+        @firestore.async_transactional
+        async def mark_read(transaction) -> Optional[str]:
+            message_doc = await message_ref.get(transaction=transaction)
+            if not message_doc.exists:
+                return None
+            data = message_doc.to_dict()
+            message_incident_id = data.get('incident_id')
+            if incident_id and message_incident_id != incident_id:
+                return None
+
+            if message_incident_id and not data.get('is_read'):
+                sender_id = data.get('sender_id')
+                counter_ref = self.counters_collection.document(message_incident_id)
+                counter_doc = await counter_ref.get(transaction=transaction)
+                if counter_doc.exists:
+                    unread_by_sender = counter_doc.to_dict().get('unread_by_sender', {})
+                    # Clamp at zero rather than going negative
+                    if unread_by_sender.get(sender_id, 0) > 0:
+                        transaction.update(counter_ref, {_unread_path(sender_id): firestore.Increment(-1)})
+                else:
+                    # The seed still counts this message as unread
+                    unread_by_sender = await self._count_unread_by_sender(message_incident_id, transaction)
+                    unread_by_sender[sender_id] = max(unread_by_sender.get(sender_id, 0) - 1, 0)
+                    transaction.set(counter_ref, {'incident_id': message_incident_id, 'unread_by_sender': unread_by_sender})
+
+            transaction.update(message_ref, {
                 'is_read': True,
-                'read_by': user_id,
+                'read_by': firestore.ArrayUnion([user_id]),
                 'read_at': datetime.utcnow()
             })
+            return message_incident_id
 
-            # PERFORMANCE: Invalidate unread count cache
-            if incident_id:
-                _unread_cache.invalidate(incident_id)
-
-            return True
+        try:
+            message_incident_id = await mark_read(self.db.transaction())
         except Exception:
             return False
 
+        if message_incident_id:
+            # PERFORMANCE: Invalidate unread count cache
+            _unread_cache.invalidate(message_incident_id)
+        return message_incident_id is not None
+
+    async def _count_unread_by_sender(self, incident_id: str, transaction) -> Dict[str, int]:
+        """Unread messages per sender for an incident, read inside a transaction"""
+        query = self.messages_collection.where('incident_id', '==', incident_id).where('is_read', '==', False).select(['sender_id'])
+        unread_by_sender: Dict[str, int] = defaultdict(int)
+        async for doc in query.stream(transaction=transaction):
+            unread_by_sender[doc.to_dict().get('sender_id')] += 1
+        return dict(unread_by_sender)
+
     async def get_unread_count(self, incident_id: str, user_id: str) -> int:
         """Get count of unread messages for user in incident - CACHED"""
-        cache_key = f"{incident_id}_{user_id}"
-
         # Check cache first
-        cached = _unread_cache.get(cache_key)
+        cached = _unread_cache.get(incident_id, user_id)
         if cached is not None:
             return cached
 
-        # Query database
-        query = self.messages_collection.where('incident_id', '==', incident_id).where('is_read', '==', False).where('sender_id', '!=', user_id)
-        docs = list(query.stream())
-        count = len(docs)
+        counter_doc = await self.counters_collection.document(incident_id).get()
+        if counter_doc.exists:
+            # Single document read: sum unread messages sent by everyone else
+            unread_by_sender = counter_doc.to_dict().get('unread_by_sender', {})
+            count = sum(max(n, 0) for sender, n in unread_by_sender.items() if sender != user_id)
+        else:
+            # No message has been sent or read since the counter was introduced
+            query = self.messages_collection.where('incident_id', '==', incident_id).where('is_read', '==', False).where('sender_id', '!=', user_id)
+            # COUNT aggregation returns a single integer instead of every document
+            snapshot = await query.count().get()
+            count = snapshot[0][0].value
 
         # Cache the result
-        _unread_cache.set(cache_key, count)
-        return count
\ No newline at end of file
+        _unread_cache.set(incident_id, user_id, count)
+        return count
@@ -4,26 +4,37 @@ Handles WebSocket connections, disconnections, and message broadcasting
 """
 
 from fastapi import WebSocket
-from typing import Dict, List, Optional
-import json
+from typing import Dict, List, Optional, Set, Tuple, Union
+import asyncio
+import orjson
+
+HEARTBEAT_INTERVAL_SECONDS = 30
+HEARTBEAT_TIMEOUT_SECONDS = 5
+HEARTBEAT_PAYLOAD = orjson.dumps({'type': 'ping'}).decode()
+
 
 class ConnectionManager:
     def __init__(self):
         # Store active connections: {user_id: WebSocket}
         self.active_connections: Dict[str, WebSocket] = {}
-        # Store room-based connections: {room_id: {user_id: WebSocket}}
-        self.room_connections: Dict[str, Dict[str, WebSocket]] = {}
+        # Store room-based connections flat: {(room_id, user_id): WebSocket}
+        self.room_sockets: Dict[Tuple[str, str], WebSocket] = {}
+        # Index of room membership for broadcasts: {room_id: {user_id}}
+        self.room_members: Dict[str, Set[str]] = {}
+        # Started lazily on first connect, once an event loop is running
+        self._heartbeat_task: Optional[asyncio.Task] = None
 
     async def connect(self, websocket: WebSocket, user_id: str, room_id: Optional[str] = None):
         """Connect a user to WebSocket"""
         # WebSocket should already be accepted by the route handler
         # await websocket.accept()  # REMOVED - duplicate accept
         
+        self._ensure_heartbeat()
+
         if room_id:
             # Room-based connection
-            if room_id not in self.room_connections:
-                self.room_connections[room_id] = {}
-            self.room_connections[room_id][user_id] = websocket
+            self.room_sockets[(room_id, user_id)] = websocket
+            self.room_members.setdefault(room_id, set()).add(user_id)
         else:
             # General connection
             self.active_connections[user_id] = websocket
@@ -34,11 +45,7 @@ class ConnectionManager:
         """Disconnect a user from WebSocket"""
         if room_id:
             # Remove from room connections
-            if room_id in self.room_connections and user_id in self.room_connections[room_id]:
-                del self.room_connections[room_id][user_id]
-                if not self.room_connections[room_id]:
-                    # Remove empty room
-                    del self.room_connections[room_id]
+            self._remove_room_member(room_id, user_id)
         else:
             # Remove from general connections
             if user_id in self.active_connections:
@@ -46,78 +53,152 @@ class ConnectionManager:
         
         print(f"WebSocket disconnected: user_id={user_id}, room_id={room_id}")
 
+    def _remove_room_member(self, room_id: str, user_id: str):
+        self.room_sockets.pop((room_id, user_id), None)
+        members = self.room_members.get(room_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                # Remove empty room
+                del self.room_members[room_id]
+
+    def _ensure_heartbeat(self):
+        """Start the heartbeat loop if it is not already running"""
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        """Cancel the heartbeat loop; called from the app shutdown hook"""
+        task, self._heartbeat_task = self._heartbeat_task, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _ping(self, connection: WebSocket):
+        await asyncio.wait_for(connection.send_text(HEARTBEAT_PAYLOAD), HEARTBEAT_TIMEOUT_SECONDS)
+
+    async def _heartbeat(self):
+        """Ping every socket periodically so dead ones are pruned before broadcasts hit them"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            targets = [(user_id, connection, None) for user_id, connection in list(self.active_connections.items())]
+            targets.extend((user_id, connection, room_id) for (room_id, user_id), connection in list(self.room_sockets.items()))
+            if not targets:
+                continue
+
+            results = await asyncio.gather(
+                *[self._ping(connection) for _, connection, _ in targets],
+                return_exceptions=True
+            )
+            for (user_id, connection, room_id), result in zip(targets, results):
+                if isinstance(result, Exception):
+                    print(f"Heartbeat failed for user_id={user_id}, room_id={room_id}; dropping connection")
+                    self._drop_connection(user_id, connection, room_id)
+
+    def _drop_connection(self, user_id: str, connection: WebSocket, room_id: Optional[str] = None):
+        """Remove a broken connection unless it was replaced while we were sending"""
+        if room_id:
+            if self.room_sockets.get((room_id, user_id)) is connection:
+                self._remove_room_member(room_id, user_id)
+        elif self.active_connections.get(user_id) is connection:
+            del self.active_connections[user_id]
+
     async def send_personal_message(self, message: str, user_id: str):
         """Send a message to a specific user"""
-        if user_id in self.active_connections:
+        connection = self.active_connections.get(user_id)
+        if connection:
             try:
-                await self.active_connections[user_id].send_text(message)
+                await connection.send_text(message)
             except Exception as e:
                 print(f"Failed to send message to {user_id}: {str(e)}")
                 # Remove broken connection
-                del self.active_connections[user_id]
+                self._drop_connection(user_id, connection)
 
-    async def broadcast(self, message: str):
+    @staticmethod
+    def _prepare_payload(message: Union[str, dict]) -> str:
+        """Serialize a broadcast payload once, up front, for every recipient"""
+        if isinstance(message, str):
+            return message
+        # orjson handles datetimes natively; anything else falls back to str()
+        return orjson.dumps(message, default=str).decode()
+
+    async def _broadcast_prepared(self, connections: List[Tuple[str, WebSocket]], payload: str) -> List[Tuple[str, WebSocket]]:
+        """Send one prepared payload to many connections, returning the broken ones"""
+        # Fan out concurrently so one slow client does not delay the rest
+        results = await asyncio.gather(
+            *[connection.send_text(payload) for _, connection in connections],
+            return_exceptions=True
+        )
+
+        failed = []
+        for (user_id, connection), result in zip(connections, results):
+            if isinstance(result, Exception):
+                print(f"Failed to broadcast to {user_id}: {str(result)}")
+                failed.append((user_id, connection))
+        return failed
+
+    async def broadcast(self, message: Union[str, dict]):
         """Broadcast a message to all connected users"""
-        disconnected_users = []
-        
-        for user_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Failed to broadcast to {user_id}: {str(e)}")
-                disconnected_users.append(user_id)
-        
+        payload = self._prepare_payload(message)
+        failed = await self._broadcast_prepared(list(self.active_connections.items()), payload)
+
         # Remove broken connections
-        for user_id in disconnected_users:
-            del self.active_connections[user_id]
+        for user_id, connection in failed:
+            self._drop_connection(user_id, connection)
 
-    async def broadcast_to_room(self, room_id: str, message: str):
+    async def broadcast_to_room(self, room_id: str, message: Union[str, dict]):
         """Broadcast a message to all users in a specific room"""
-        if room_id not in self.room_connections:
+        members = self.room_members.get(room_id)
+        if not members:
             return
         
-        disconnected_users = []
-        
-        for user_id, connection in self.room_connections[room_id].items():
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Failed to broadcast to {user_id} in room {room_id}: {str(e)}")
-                disconnected_users.append(user_id)
-        
+        payload = self._prepare_payload(message)
+        connections = [(user_id, self.room_sockets[(room_id, user_id)]) for user_id in list(members)]
+        failed = await self._broadcast_prepared(connections, payload)
+
         # Remove broken connections
-        for user_id in disconnected_users:
-            del self.room_connections[room_id][user_id]
+        for user_id, connection in failed:
+            self._drop_connection(user_id, connection, room_id)
 
     def get_connection_count(self) -> dict:
         """Get the number of active connections"""
         return {
             'general_connections': len(self.active_connections),
-            'room_connections': {room_id: len(connections) for room_id, connections in self.room_connections.items()},
-            'total_rooms': len(self.room_connections)
+            'room_connections': {room_id: len(members) for room_id, members in self.room_members.items()},
+            'total_rooms': len(self.room_members)
         }
     
-    async def send_to_user(self, user_id: str, message: str):
+    async def send_to_user(self, user_id: str, message: Union[str, dict]):
         """Send a message to a specific user across all their connections"""
+        message = self._prepare_payload(message)
         sent = False
         
         # Check general connections
-        if user_id in self.active_connections:
+        connection = self.active_connections.get(user_id)
+        if connection:
             try:
-                await self.active_connections[user_id].send_text(message)
+                await connection.send_text(message)
                 sent = True
             except Exception as e:
                 print(f"Failed to send to user {user_id} in general connections: {str(e)}")
-                del self.active_connections[user_id]
+                self._drop_connection(user_id, connection)
         
-        # Check room connections
-        for room_id, connections in self.room_connections.items():
-            if user_id in connections:
-                try:
-                    await connections[user_id].send_text(message)
-                    sent = True
-                except Exception as e:
-                    print(f"Failed to send to user {user_id} in room {room_id}: {str(e)}")
-                    del connections[user_id]
+        # Check room connections (snapshot first - rooms can change while we await)
+        room_targets = [
+            (room_id, self.room_sockets[(room_id, user_id)])
+            for room_id, members in list(self.room_members.items())
+            if user_id in members
+        ]
+        for room_id, connection in room_targets:
+            try:
+                await connection.send_text(message)
+                sent = True
+            except Exception as e:
+                print(f"Failed to send to user {user_id} in room {room_id}: {str(e)}")
+                self._drop_connection(user_id, connection, room_id)
         
-        return sent
\ No newline at end of file
+        return sent
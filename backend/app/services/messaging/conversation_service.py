@@ -3,9 +3,16 @@ Conversation Service - Enhanced Chat System
 Handles conversation creation, management, and permissions
 """
 
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import List, Optional, Dict, Any, Set
+from copy import deepcopy
+from datetime import datetime, timezone
+from functools import lru_cache
 from uuid import uuid4
+import asyncio
+import os
+import re
+
+from firebase_admin import firestore
 
 from app.models.conversation import (
     ConversationCreate, ConversationResponse, ConversationUpdate,
@@ -13,39 +20,84 @@ from app.models.conversation import (
     ConversationPermissions
 )
 from app.core.firebase_config import FirebaseConfig
+from app.services.incidents.incident_service import IncidentService
+from app.utils.cache import TTLCache
+from app.utils.logging import get_logger, log_sampled
+from app.utils.user_cache import user_cache, missing_user_cache, user_doc_cache
 
 
-import time
+import logging
 
-# Simple in-memory cache for conversations
-class ConversationCache:
-    def __init__(self, ttl_seconds: int = 30):
-        self._cache: Dict[str, Any] = {}
-        self._timestamps: Dict[str, float] = {}
-        self._ttl = ttl_seconds
+logger = get_logger(__name__)
 
-    def get(self, key: str) -> Optional[Any]:
-        if key in self._cache and time.time() - self._timestamps.get(key, 0) < self._ttl:
-            return self._cache[key]
-        return None
+# Firestore rejects batches with more than 500 writes
+BATCH_WRITE_LIMIT = 500
+# Conversation types visible to employees (team internal chats are hidden)
+EMPLOYEE_CONVERSATION_TYPES = [
+    ConversationType.INCIDENT_CHAT.value,
+    ConversationType.DIRECT_MESSAGE.value
+]
+# Firestore allows up to 30 values in an 'in' filter
+IN_QUERY_LIMIT = 30
+# Stored value -> enum member, built once instead of calling the enum constructor per row
+_CONVERSATION_TYPES = {member.value: member for member in ConversationType}
+_CONVERSATION_STATUSES = {member.value: member for member in ConversationStatus}
+# Response fields that need joins beyond the conversation document itself
+_ENRICHED_FIELDS = frozenset({'participants', 'incident_title'})
+
+
+def _chunks(items: List[Any], size: int):
+    """Split a list into consecutive slices of at most `size` items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+_TEST_NAME_RE = re.compile('test', re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def _resolve_display_name(full_name: Optional[str], email: Optional[str]) -> str:
+    """Display name for a participant: first name, else email prefix, never a "test" name"""
+    name = (full_name or '').strip()
+    if name and not _TEST_NAME_RE.search(name):
+        # Use only the first part of the actual name (first name)
+        return name.split(None, 1)[0]
+    # Use email prefix (before @) as fallback
+    local_part, at, _ = (email or '').partition('@')
+    if at:
+        return local_part.replace('.', ' ').title()
+    return 'User'
+
+_conversation_cache = TTLCache(ttl_seconds=300)  # Writes invalidate, so the TTL only bounds missed updates
+_membership_cache = TTLCache(ttl_seconds=300)  # "mem_{conversation_id}_{user_id}" -> bool
+_incident_conversation_cache = TTLCache(ttl_seconds=600)  # incident_id -> conversation_id
+# "legacy_{user_id}" -> the user's conversations without embedded participants
+_legacy_conversation_cache = TTLCache(ttl_seconds=60)
+# Conversation lists also join conversation_participants for documents without
+# participant_ids. Set to false once scripts/backfill_conversation_participants.py has run
+LEGACY_PARTICIPANT_FALLBACK = os.getenv('CONVERSATION_LEGACY_FALLBACK', 'true').lower() == 'true'
 
-    def set(self, key: str, value: Any):
-        self._cache[key] = value
-        self._timestamps[key] = time.time()
+# Sorts conversations with no timestamps last
+_OLDEST = datetime.min.replace(tzinfo=timezone.utc)
 
-    def invalidate(self, key: str):
-        self._cache.pop(key, None)
-        self._timestamps.pop(key, None)
 
-_conversation_cache = ConversationCache(ttl_seconds=30)
-_user_cache = ConversationCache(ttl_seconds=60)  # Cache user data longer
+def _activity_sort_key(data: Dict[str, Any]) -> datetime:
+    return data.get('last_activity_at') or data.get('last_message_time') or data.get('created_at') or _OLDEST
 
 
 class ConversationService:
     def __init__(self):
-        self.db = FirebaseConfig.get_firestore()
+        self.db = FirebaseConfig.get_async_firestore()
         self.conversations_collection = self.db.collection('conversations')
         self.participants_collection = self.db.collection('conversation_participants')
+        self.users_collection = self.db.collection('users')
+        # Created on first incident lookup - most requests never need it
+        self._incident_service: Optional[IncidentService] = None
+
+    def _get_incident_service(self) -> IncidentService:
+        if self._incident_service is None:
+            self._incident_service = IncidentService()
+        return self._incident_service
 
     async def create_conversation(
         self,
@@ -81,115 +133,189 @@ class ConversationService:
             'last_message_sender': None,
             'last_message_time': None,
             'total_messages': 0,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow(),
+            # Sort key for conversation lists: last message time, else creation time
+            'last_activity_at': firestore.SERVER_TIMESTAMP,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'updated_at': firestore.SERVER_TIMESTAMP,
             'created_by': creator_id,
             'archived_at': None,
             'archived_by': None
         }
         
-        # Save conversation
-        self.conversations_collection.document(conversation_id).set(conversation_doc)
-        
         # Add creator as participant
-        participants = [creator_id] + conversation_data.participants
-        participants = list(set(participants))  # Remove duplicates
+        # Remove duplicates, keeping the creator first
+        participants = list(dict.fromkeys([creator_id, *conversation_data.participants]))
         
-        # Get user information for all participants from Firestore
-        from app.core.firebase_config import FirebaseConfig
-        db = FirebaseConfig.get_firestore()
-        users_collection = db.collection('users')
+        # Get user information for all participants (cached, misses in one get_all)
+        user_docs = await self._get_user_docs(participants)
         
+        participant_entries = []
         for participant_id in participants:
+            user_data = user_docs.get(participant_id)
+            if user_data:
+                user_name = _resolve_display_name(user_data.get('full_name', 'Unknown User'), user_data.get('email', ''))
+                user_role = user_data.get('role', 'employee')
+            else:
+                # Fallback for creator
+                user_name = creator_name if participant_id == creator_id else "Unknown User"
+                user_role = creator_role if participant_id == creator_id else "employee"
+            participant_entries.append((participant_id, user_name, user_role))
+        
+        # Denormalize participants onto the conversation so reads need no join
+        # (server timestamps are not allowed inside arrays, so these use client time)
+        joined_at = datetime.now(timezone.utc)
+        conversation_doc['participant_ids'] = [participant_id for participant_id, _, _ in participant_entries]
+        conversation_doc['participants'] = [
+            self._participant_entry(participant_id, user_name, user_role, joined_at)
+            for participant_id, user_name, user_role in participant_entries
+        ]
+        
+        # Save conversation and participants in batches of at most 500 writes,
+        # committing all batches concurrently rather than one after another
+        batch = self.db.batch()
+        batch.set(self.conversations_collection.document(conversation_id), conversation_doc)
+        batches = [batch]
+        pending_writes = 1
+        for participant_id, user_name, user_role in participant_entries:
+            if pending_writes == BATCH_WRITE_LIMIT:
+                batch = self.db.batch()
+                batches.append(batch)
+                pending_writes = 0
+            batch.set(*self._build_participant_doc(conversation_id, participant_id, user_name, user_role))
+            pending_writes += 1
+        await asyncio.gather(*[batch.commit() for batch in batches])
+        for participant_id in conversation_doc['participant_ids']:
+            _membership_cache.set(f"mem_{conversation_id}_{participant_id}", True)
+        
+        # Build the response from what was just written instead of reading it back
+        # (the server timestamps are approximated with the client time used for joined_at)
+        data = {
+            **conversation_doc,
+            'last_activity_at': joined_at,
+            'created_at': joined_at,
+            'updated_at': joined_at,
+            'participant_count': len(conversation_doc['participants']),
+            'conversation_type': conversation_data.conversation_type,
+            'status': ConversationStatus.ACTIVE
+        }
+        if conversation_data.conversation_type == ConversationType.INCIDENT_CHAT:
+            data['incident_title'] = title
+        result = ConversationResponse(**data)
+        _conversation_cache.set(f"conv_{conversation_id}", result)
+        return result
+
+    async def _get_user_docs(self, user_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch raw user documents, reading cache misses in one get_all round trip"""
+        user_docs = {}
+        missing = []
+        for user_id in user_ids:
+            cached = user_doc_cache.get(user_id)
+            if cached:
+                user_docs[user_id] = cached
+            else:
+                missing.append(user_id)
+
+        if missing:
             try:
-                # Get user data from Firestore
-                user_doc = users_collection.document(participant_id).get()
-                if user_doc.exists:
-                    user_data = user_doc.to_dict()
-                    full_name = user_data.get('full_name', 'Unknown User')
-                    user_role = user_data.get('role', 'employee')
-                    email = user_data.get('email', '')
-                    
-                    # Filter out "test" names
-                    if not full_name or full_name.strip() == '' or 'test' in full_name.lower():
-                        # Use email prefix as fallback
-                        if email and '@' in email:
-                            user_name = email.split('@')[0].replace('.', ' ').title()
-                        else:
-                            user_name = 'User'
-                    else:
-                        # Use only first name
-                        name_parts = full_name.strip().split()
-                        user_name = name_parts[0] if name_parts else 'User'
-                else:
-                    # Fallback for creator
-                    user_name = creator_name if participant_id == creator_id else "Unknown User"
-                    user_role = creator_role if participant_id == creator_id else "employee"
-                
-                await self.add_participant(
-                    conversation_id, 
-                    participant_id, 
-                    user_name,
-                    user_role
-                )
+                refs = [self.users_collection.document(user_id) for user_id in missing]
+                async for doc in self.db.get_all(refs):
+                    if doc.exists:
+                        user_docs[doc.id] = doc.to_dict()
+                        user_doc_cache.set(doc.id, user_docs[doc.id])
             except Exception as e:
-                print(f"Warning: Could not add participant {participant_id}: {e}")
-                # Add with fallback data
-                await self.add_participant(
-                    conversation_id, 
-                    participant_id, 
-                    creator_name if participant_id == creator_id else "Unknown User",
-                    creator_role if participant_id == creator_id else "employee"
-                )
-        
-        return await self.get_conversation(conversation_id)
+                log_sampled(logger, "participant_users", logging.WARNING, "Could not fetch participant users: %s", e)
 
-    async def get_conversation(self, conversation_id: str, skip_user_refresh: bool = False) -> Optional[ConversationResponse]:
-        """Get conversation with participants - CACHED for performance"""
+        return user_docs
 
-        # Check cache first
-        cache_key = f"conv_{conversation_id}"
-        cached = _conversation_cache.get(cache_key)
-        if cached:
-            return cached
+    async def get_conversation(
+        self,
+        conversation_id: str,
+        skip_user_refresh: bool = False,
+        fields: Optional[Set[str]] = None
+    ) -> Optional[ConversationResponse]:
+        """Get conversation with participants - CACHED for performance
+
+        Callers that only need document fields (title, type, incident_id, ...)
+        can pass them as `fields` to skip participant and incident enrichment.
+        """
+        if fields and not (fields & _ENRICHED_FIELDS):
+            # A cached full response answers metadata-only callers too
+            cached = _conversation_cache.get(f"conv_{conversation_id}")
+            if cached:
+                return cached
+            doc = await self.conversations_collection.document(conversation_id).get()
+            if not doc.exists:
+                return None
+            data = doc.to_dict()
+            # Not cached, so the full and metadata-only responses never alias
+            return ConversationResponse(**{
+                **data,
+                'participants': [],
+                'participant_count': len(data.get('participant_ids', [])),
+                'conversation_type': _CONVERSATION_TYPES.get(data.get('conversation_type')),
+                'status': _CONVERSATION_STATUSES.get(data.get('status', 'active'), ConversationStatus.ACTIVE)
+            })
+
+        # Check cache first; concurrent misses for the same conversation share one read
+        return await _conversation_cache.get_or_load(
+            f"conv_{conversation_id}",
+            lambda: self._load_conversation(conversation_id, skip_user_refresh)
+        )
 
-        doc = self.conversations_collection.document(conversation_id).get()
+    async def _load_conversation(self, conversation_id: str, skip_user_refresh: bool = False) -> Optional[ConversationResponse]:
+        doc = await self.conversations_collection.document(conversation_id).get()
 
         if not doc.exists:
             return None
 
-        data = doc.to_dict()
+        return await self._build_conversation(conversation_id, doc.to_dict(), skip_user_refresh)
 
-        # Get participants
-        participants = await self.get_conversation_participants(conversation_id)
+    async def _build_conversation(self, conversation_id: str, data: Dict[str, Any], skip_user_refresh: bool = False) -> ConversationResponse:
+        """Turn a conversation document into a cached ConversationResponse"""
+        cache_key = f"conv_{conversation_id}"
 
-        # Fetch user data - use cache to avoid redundant DB calls
-        if participants and not skip_user_refresh:
-            user_ids = [p.user_id for p in participants]
-            user_data_map = await self._batch_get_users(user_ids)
+        # Get participants - embedded on the document, or joined for legacy conversations
+        if 'participant_ids' in data:
+            participants = [
+                ConversationParticipant(**p) for p in data.get('participants', [])
+                if p.get('is_active', True)
+            ]
+        else:
+            participants = await self.get_conversation_participants(conversation_id)
+
+        # Fetch user data and incident data together - both use caches to avoid
+        # redundant DB calls, and neither lookup depends on the other
+        user_ids = [p.user_id for p in participants] if participants and not skip_user_refresh else []
+        incident_ids = [data['incident_id']] if (
+            data.get('conversation_type') == ConversationType.INCIDENT_CHAT.value and data.get('incident_id')
+        ) else []
+        user_data_map, incident_data_map = await asyncio.gather(
+            self._batch_get_users(user_ids), self._get_cached_incidents(incident_ids)
+        )
 
-            # Update participant data
-            updated_participants = []
-            for p in participants:
-                p_dict = p.dict()
-                if p.user_id in user_data_map:
-                    p_dict['user_name'] = user_data_map[p.user_id]['user_name']
-                    p_dict['user_role'] = user_data_map[p.user_id]['user_role']
-                updated_participants.append(p_dict)
+        # Update participant data
+        updated_participants = []
+        for p in participants or []:
+            fresh = user_data_map.get(p.user_id)
+            if fresh:
+                # Skip dumping the two fields that are about to be overwritten
+                p_dict = p.model_dump(exclude={'user_name', 'user_role'})
+                p_dict.update(fresh)
+            else:
+                p_dict = p.model_dump()
+            updated_participants.append(p_dict)
 
-            data['participants'] = updated_participants
-        else:
-            data['participants'] = [p.dict() for p in participants] if participants else []
+        data['participants'] = updated_participants
 
         data['participant_count'] = len(data.get('participants', []))
 
         # Convert enum strings back to enums
-        data['conversation_type'] = ConversationType(data['conversation_type'])
-        data['status'] = ConversationStatus(data['status'])
+        data['conversation_type'] = _CONVERSATION_TYPES.get(data['conversation_type'])
+        data['status'] = _CONVERSATION_STATUSES.get(data['status'], ConversationStatus.ACTIVE)
 
         # Fetch incident title - use cache
         if data.get('conversation_type') == ConversationType.INCIDENT_CHAT and data.get('incident_id'):
-            incident_data = await self._get_cached_incident(data['incident_id'])
+            incident_data = incident_data_map.get(data['incident_id'])
             if incident_data:
                 data['incident_title'] = incident_data.get('title', data.get('title', 'Incident'))
                 # Update employee participant name from incident reporter
@@ -219,41 +345,43 @@ class ConversationService:
 
         # Check cache first
         for user_id in user_ids:
-            cached = _user_cache.get(f"user_{user_id}")
+            cached = user_cache.get(f"user_{user_id}")
             if cached:
                 user_data_map[user_id] = cached
-            else:
+            elif not missing_user_cache.get(user_id):
+                # Known-missing users are skipped, so callers keep their stored names
                 uncached_ids.append(user_id)
 
-        # Fetch uncached users from DB
+        # Fetch uncached users from DB by document ID, one get_all per chunk
+        # with all chunks in flight at once
         if uncached_ids:
-            from app.core.firebase_config import FirebaseConfig
-            db = FirebaseConfig.get_firestore()
-            users_collection = db.collection('users')
+            chunk_results = await asyncio.gather(
+                *[
+                    self._get_all_docs([self.users_collection.document(user_id) for user_id in batch_ids])
+                    for batch_ids in _chunks(uncached_ids, IN_QUERY_LIMIT)
+                ],
+                return_exceptions=True
+            )
+            user_docs = []
+            for chunk in chunk_results:
+                if isinstance(chunk, Exception):
+                    log_sampled(logger, "batch_get_users", logging.WARNING, "Could not fetch users: %s", chunk)
+                    continue
+                user_docs.extend(chunk)
 
-            for user_id in uncached_ids:
+            for user_doc in user_docs:
                 try:
-                    user_doc = users_collection.document(user_id).get()
                     if user_doc.exists:
+                        user_id = user_doc.id
                         user_info = user_doc.to_dict()
-                        full_name = user_info.get('full_name', '')
-                        email = user_info.get('email', '')
-
-                        if not full_name or full_name.strip() == '' or 'test' in full_name.lower():
-                            if email and '@' in email:
-                                full_name = email.split('@')[0].replace('.', ' ').title()
-                            else:
-                                full_name = 'User'
-                        else:
-                            name_parts = full_name.strip().split()
-                            full_name = name_parts[0] if name_parts else 'User'
-
                         user_data = {
-                            'user_name': full_name,
+                            'user_name': _resolve_display_name(user_info.get('full_name', ''), user_info.get('email', '')),
                             'user_role': user_info.get('role', 'employee')
                         }
                         user_data_map[user_id] = user_data
-                        _user_cache.set(f"user_{user_id}", user_data)
+                        user_cache.set(f"user_{user_id}", user_data)
+                    else:
+                        missing_user_cache.set(user_doc.id, True)
                 except Exception:
                     pass
 
@@ -261,20 +389,25 @@ class ConversationService:
 
     async def _get_cached_incident(self, incident_id: str) -> Optional[Dict]:
         """Get incident data with caching"""
-        cache_key = f"incident_{incident_id}"
-        cached = _conversation_cache.get(cache_key)
-        if cached:
-            return cached
+        async def load_incident():
+            try:
+                return await self._get_incident_service().get_incident(incident_id) or None
+            except Exception:
+                return None
 
-        try:
-            from app.services.incidents.incident_service import IncidentService
-            incident_service = IncidentService()
-            incident = await incident_service.get_incident(incident_id)
-            if incident:
-                _conversation_cache.set(cache_key, incident)
-            return incident
-        except Exception:
-            return None
+        return await _conversation_cache.get_or_load(f"incident_{incident_id}", load_incident)
+
+    async def _get_cached_incidents(self, incident_ids: List[str]) -> Dict[str, Dict]:
+        """Get incident data for several incidents concurrently, keyed by incident id"""
+        incidents = await asyncio.gather(
+            *[self._get_cached_incident(incident_id) for incident_id in incident_ids],
+            return_exceptions=True
+        )
+        return {
+            incident_id: incident
+            for incident_id, incident in zip(incident_ids, incidents)
+            if incident and not isinstance(incident, Exception)
+        }
 
     async def get_user_conversations(
         self,
@@ -282,140 +415,100 @@ class ConversationService:
         user_role: str,
         conversation_type: Optional[ConversationType] = None,
         limit: int = 20,
-        offset: int = 0
+        offset: int = 0,
+        include_participants: bool = True,
+        include_incident_details: bool = True
     ) -> List[ConversationResponse]:
-        """Get conversations for a user based on their role and permissions"""
-
-        # Get conversations where user is a participant
-        participant_query = self.participants_collection.where('user_id', '==', user_id)
-        participant_docs = list(participant_query.stream())
+        """Get conversations for a user based on their role and permissions
 
-        conversation_ids = [doc.to_dict()['conversation_id'] for doc in participant_docs]
+        List views that only need titles and last-message previews can turn off
+        include_participants / include_incident_details to skip the user and
+        incident lookups.
+        """
 
-        if not conversation_ids:
+        # Role-based filtering
+        if user_role == "employee" and conversation_type == ConversationType.TEAM_INTERNAL:
             return []
 
-        # PERFORMANCE FIX: Batch load conversations instead of N+1 queries
-        # Firestore 'in' query has limit of 10, so batch if needed
-        conversations_data = []
-        for i in range(0, len(conversation_ids), 10):
-            batch_ids = conversation_ids[i:i+10]
-            batch_docs = self.conversations_collection.where('id', 'in', batch_ids).stream()
-            for doc in batch_docs:
+        # Get conversations where user is a participant - participants are embedded,
+        # so one query returns everything without joining conversation_participants
+        conversation_query = self.conversations_collection.where('participant_ids', 'array_contains', user_id)
+        if conversation_type:
+            conversation_query = conversation_query.where('conversation_type', '==', conversation_type.value)
+        elif user_role == "employee":
+            conversation_query = conversation_query.where('conversation_type', 'in', EMPLOYEE_CONVERSATION_TYPES)
+
+        conversation_query = conversation_query.order_by('last_activity_at', direction=firestore.Query.DESCENDING)
+
+        # Conversations that predate embedded participants are invisible to the query above
+        legacy_data = [
+            data for data in await self._get_legacy_user_conversations(user_id)
+            if (data.get('conversation_type') == conversation_type.value if conversation_type
+                else user_role != "employee" or data.get('conversation_type') in EMPLOYEE_CONVERSATION_TYPES)
+        ]
+
+        if legacy_data:
+            # Merge both sources, then cut the requested page out of the combined order
+            merged = {data.get('id'): data for data in legacy_data}
+            async for doc in conversation_query.limit(offset + limit).stream():
                 data = doc.to_dict()
-                conversations_data.append(data)
+                merged[data.get('id')] = data
+            conversations_data = sorted(merged.values(), key=_activity_sort_key, reverse=True)[offset:offset + limit]
+        else:
+            # Sort and paginate in Firestore so only the requested page is read
+            conversation_query = conversation_query.offset(offset).limit(limit)
+            conversations_data = [doc.to_dict() async for doc in conversation_query.stream()]
 
-        # Batch load all participants for these conversations
-        all_participants = {}
-        for i in range(0, len(conversation_ids), 10):
-            batch_ids = conversation_ids[i:i+10]
-            participant_docs = self.participants_collection.where('conversation_id', 'in', batch_ids).stream()
-            for pdoc in participant_docs:
-                pdata = pdoc.to_dict()
-                conv_id = pdata.get('conversation_id')
-                if conv_id not in all_participants:
-                    all_participants[conv_id] = []
-                all_participants[conv_id].append(pdata)
+        if not conversations_data:
+            return []
+
+        all_participants = {
+            data.get('id'): data.get('participants', [])
+            for data in conversations_data
+        }
         
         # Batch fetch fresh user data for all participants
-        all_user_ids = set()
-        for participants_list in all_participants.values():
-            for p in participants_list:
-                all_user_ids.add(p.get('user_id'))
+        all_user_ids = {
+            p.get('user_id') for participants_list in all_participants.values() for p in participants_list
+        } if include_participants else set()
         
-        
-        # Fetch all user data by document ID (more reliable than field queries)
-        user_data_map = {}
-        if all_user_ids:
-            from app.core.firebase_config import FirebaseConfig
-            db = FirebaseConfig.get_firestore()
-            users_collection = db.collection('users')
+        # PERFORMANCE: Batch fetch all incident data at once
+        incident_ids = [
+            data.get('incident_id') for data in conversations_data
+            if data.get('conversation_type') == ConversationType.INCIDENT_CHAT.value and data.get('incident_id')
+        ] if include_incident_details else []
 
-            user_ids_list = list(all_user_ids)
-            for user_id in user_ids_list:
-                try:
-                    # Fetch user by document ID directly (more reliable)
-                    user_doc = users_collection.document(user_id).get()
-                    if user_doc.exists:
-                        user_info = user_doc.to_dict()
-                        full_name = user_info.get('full_name', '')
-                        email = user_info.get('email', '')
-
-                        # Filter out "test" names and use email prefix or better fallback
-                        if not full_name or full_name.strip() == '' or 'test' in full_name.lower():
-                            # Use email prefix (before @) as fallback
-                            if email and '@' in email:
-                                full_name = email.split('@')[0].replace('.', ' ').title()
-                            else:
-                                full_name = 'User'
-                        else:
-                            # Use only the first part of the actual name (first name)
-                            name_parts = full_name.strip().split()
-                            full_name = name_parts[0] if name_parts else 'User'
-
-                        user_data_map[user_id] = {
-                            'full_name': full_name,
-                            'role': user_info.get('role', 'employee')
-                        }
-                except Exception as e:
-                    pass
+        # Refresh names and roles of the embedded participants through the shared
+        # user cache, overlapped with the incident lookups since neither depends on the other
+        user_data_map, incident_data_map = await asyncio.gather(
+            self._batch_get_users(list(all_user_ids)), self._get_cached_incidents(incident_ids)
+        )
         
         # Update participant data with fresh user info
-        for conv_id, participants_list in all_participants.items():
+        for conv_id, participants_list in (all_participants.items() if include_participants else ()):
             for p in participants_list:
                 user_id = p.get('user_id')
                 if user_id in user_data_map:
-                    p['user_name'] = user_data_map[user_id]['full_name']
-                    p['user_role'] = user_data_map[user_id]['role']
+                    p['user_name'] = user_data_map[user_id]['user_name']
+                    p['user_role'] = user_data_map[user_id]['user_role']
                 else:
                     # User not found in our batch fetch - use existing name or fallback
-                    current_name = p.get('user_name', '')
-                    if not current_name or current_name.strip() == '' or 'test' in current_name.lower():
-                        p['user_name'] = 'User'
-                    else:
-                        # Use first name only
-                        name_parts = current_name.strip().split()
-                        p['user_name'] = name_parts[0] if name_parts else 'User'
-
-                # Final check: ensure no "test" slips through
-                final_name = p.get('user_name', '')
-                if 'test' in final_name.lower():
-                    p['user_name'] = 'User'
-
-        # PERFORMANCE: Batch fetch all incident data at once
-        incident_ids = [
-            data.get('incident_id') for data in conversations_data
-            if data.get('conversation_type') == ConversationType.INCIDENT_CHAT.value and data.get('incident_id')
-        ]
-
-        incident_data_map = {}
-        if incident_ids:
-            for incident_id in incident_ids:
-                incident_data = await self._get_cached_incident(incident_id)
-                if incident_data:
-                    incident_data_map[incident_id] = incident_data
+                    p['user_name'] = _resolve_display_name(p.get('user_name', ''), None)
 
         conversations = []
         for data in conversations_data:
             try:
                 conv_id = data.get('id')
 
-                # Filter by conversation type if specified
-                conv_type_str = data.get('conversation_type')
-                conv_type = ConversationType(conv_type_str) if conv_type_str else None
-
-                if conversation_type and conv_type != conversation_type:
-                    continue
-
-                # Role-based filtering
-                if user_role == "employee" and conv_type == ConversationType.TEAM_INTERNAL:
-                    continue
+                # Type and role filters were applied by the query itself
+                conv_type = _CONVERSATION_TYPES.get(data.get('conversation_type'))
 
                 # Add participants from batch-loaded data
-                data['participants'] = all_participants.get(conv_id, [])
-                data['participant_count'] = len(data['participants'])
+                participants = all_participants.get(conv_id, [])
+                data['participants'] = participants if include_participants else []
+                data['participant_count'] = len(participants)
                 data['conversation_type'] = conv_type
-                data['status'] = ConversationStatus(data.get('status', 'active'))
+                data['status'] = _CONVERSATION_STATUSES.get(data.get('status', 'active'), ConversationStatus.ACTIVE)
 
                 # Use pre-fetched incident data
                 if conv_type == ConversationType.INCIDENT_CHAT and data.get('incident_id'):
@@ -438,19 +531,25 @@ class ConversationService:
             except Exception:
                 continue
 
-        # Sort by last message time
-        conversations.sort(key=lambda x: x.last_message_time or x.created_at, reverse=True)
-
-        # Apply pagination
-        return conversations[offset:offset + limit]
+        return conversations
 
     async def get_incident_conversation(self, incident_id: str) -> Optional[ConversationResponse]:
         """Get the conversation for a specific incident"""
-        query = self.conversations_collection.where('incident_id', '==', incident_id).where('conversation_type', '==', ConversationType.INCIDENT_CHAT.value)
-        docs = list(query.stream())
-        
-        if docs:
-            return await self.get_conversation(docs[0].id)
+        conversation_id = _incident_conversation_cache.get(incident_id)
+        if conversation_id:
+            conversation = await self.get_conversation(conversation_id)
+            if conversation:
+                return conversation
+            _incident_conversation_cache.invalidate(incident_id)
+
+        query = self.conversations_collection.where('incident_id', '==', incident_id).where('conversation_type', '==', ConversationType.INCIDENT_CHAT.value).limit(1)
+        async for doc in query.stream():
+            _incident_conversation_cache.set(incident_id, doc.id)
+            # Build from the document the query already returned instead of reading it again
+            cached = _conversation_cache.get(f"conv_{doc.id}")
+            if cached:
+                return cached
+            return await self._build_conversation(doc.id, doc.to_dict())
         return None
 
     async def create_incident_conversation(
@@ -467,13 +566,11 @@ class ConversationService:
         # Get incident details for title
         incident_title = "Incident"
         try:
-            from app.services.incidents.incident_service import IncidentService
-            incident_service = IncidentService()
-            incident = await incident_service.get_incident(incident_id)
+            incident = await self._get_incident_service().get_incident(incident_id)
             if incident:
                 incident_title = incident.get('title', 'Incident')
         except Exception as e:
-            print(f"Warning: Could not fetch incident title: {e}")
+            logger.warning("Could not fetch incident title for %s: %s", incident_id, e)
         
         if target_members:
             # Add specific target members (for targeted conversations)
@@ -484,24 +581,18 @@ class ConversationService:
         else:
             # Add all security team members (fallback for general conversations)
             try:
-                from app.core.firebase_config import FirebaseConfig
-                db = FirebaseConfig.get_firestore()
-                users_collection = db.collection('users')
-                
                 # Get all security team members
-                security_team_query = users_collection.where('role', '==', 'security_team')
+                security_team_query = self.users_collection.where('role', '==', 'security_team')
                 security_team_docs = security_team_query.stream()
                 
-                for doc in security_team_docs:
-                    user_data = doc.to_dict()
-                    if user_data.get('uid') not in participants:
-                        participants.append(user_data.get('uid'))
+                async for doc in security_team_docs:
+                    participants.append(doc.to_dict().get('uid'))
                         
             except Exception as e:
-                print(f"Warning: Could not add security team to conversation: {e}")
+                logger.warning("Could not add security team to conversation: %s", e, exc_info=True)
         
-        # Remove duplicates
-        participants = list(set(participants))
+        # Remove duplicates, keeping the reporter first
+        participants = list(dict.fromkeys(participants))
         
         conversation_data = ConversationCreate(
             conversation_type=ConversationType.INCIDENT_CHAT,
@@ -511,12 +602,15 @@ class ConversationService:
             is_private=len(participants) <= 2  # Private if just 2 people
         )
         
-        return await self.create_conversation(
+        conversation = await self.create_conversation(
             conversation_data,
             reporter_id,
             reporter_name,
             "employee"
         )
+        if conversation:
+            _incident_conversation_cache.set(incident_id, conversation.id)
+        return conversation
 
     async def add_participant(
         self,
@@ -526,6 +620,49 @@ class ConversationService:
         user_role: str
     ) -> bool:
         """Add participant to conversation"""
+        conversation_ref = self.conversations_collection.document(conversation_id)
+        entry = self._participant_entry(user_id, user_name, user_role, datetime.now(timezone.utc))
+
+        # Keep the denormalized participant list on the conversation in step
+        conversation_doc = await conversation_ref.get(field_paths=['participant_ids'])
+        if conversation_doc.exists and 'participant_ids' not in conversation_doc.to_dict():
+            # Legacy conversation: an ArrayUnion here would leave only the new member
+            # embedded, so write the full list from conversation_participants instead
+            existing = (await self._load_legacy_participants([conversation_id])).get(conversation_id, [])
+            participants = [
+                {
+                    **self._participant_entry(p.get('user_id'), p.get('user_name'), p.get('user_role'), p.get('joined_at')),
+                    'last_read_at': p.get('last_read_at')
+                }
+                for p in existing if p.get('user_id') != user_id
+            ]
+            participants.append(entry)
+            conversation_update = {
+                'participant_ids': [p['user_id'] for p in participants],
+                'participants': participants
+            }
+        else:
+            conversation_update = {
+                'participant_ids': firestore.ArrayUnion([user_id]),
+                'participants': firestore.ArrayUnion([entry])
+            }
+
+        batch = self.db.batch()
+        batch.set(*self._build_participant_doc(conversation_id, user_id, user_name, user_role))
+        batch.update(conversation_ref, conversation_update)
+        await batch.commit()
+        _conversation_cache.invalidate(f"conv_{conversation_id}")
+        _membership_cache.set(f"mem_{conversation_id}_{user_id}", True)
+        return True
+
+    def _build_participant_doc(
+        self,
+        conversation_id: str,
+        user_id: str,
+        user_name: str,
+        user_role: str
+    ):
+        """Participant document and its reference in conversation_participants"""
         participant_id = f"{conversation_id}_{user_id}"
         
         participant_doc = {
@@ -534,23 +671,89 @@ class ConversationService:
             'user_id': user_id,
             'user_name': user_name,
             'user_role': user_role,
-            'joined_at': datetime.utcnow(),
+            'joined_at': firestore.SERVER_TIMESTAMP,
             'is_active': True,
             'last_read_at': None
         }
         
-        self.participants_collection.document(participant_id).set(participant_doc)
-        return True
+        return self.participants_collection.document(participant_id), participant_doc
+
+    async def _load_legacy_participants(self, conversation_ids: List[str]) -> Dict[str, List[Dict]]:
+        """Active participant records for conversations without embedded participants"""
+        # One query per chunk, in parallel
+        chunk_results = await asyncio.gather(*[
+            self._stream_docs(
+                self.participants_collection.where('conversation_id', 'in', batch_ids).where('is_active', '==', True)
+            )
+            for batch_ids in _chunks(conversation_ids, IN_QUERY_LIMIT)
+        ])
+
+        participants = {}
+        for participant_docs in chunk_results:
+            for pdoc in participant_docs:
+                pdata = pdoc.to_dict()
+                participants.setdefault(pdata.get('conversation_id'), []).append(pdata)
+        return participants
+
+    async def _get_legacy_user_conversations(self, user_id: str) -> List[Dict[str, Any]]:
+        """Conversation docs a user is in that still lack participant_ids, with participants attached"""
+        if not LEGACY_PARTICIPANT_FALLBACK:
+            return []
+
+        async def load_legacy():
+            participant_docs = await self._stream_docs(
+                self.participants_collection.where('user_id', '==', user_id).select(['conversation_id'])
+            )
+            conversation_ids = list(dict.fromkeys(pdoc.to_dict().get('conversation_id') for pdoc in participant_docs))
+            if not conversation_ids:
+                return []
+
+            # Check membership fields only; full documents are read just for legacy ones
+            markers = await self._get_all_docs(
+                [self.conversations_collection.document(conv_id) for conv_id in conversation_ids],
+                field_paths=['participant_ids']
+            )
+            legacy_refs = [doc.reference for doc in markers if doc.exists and 'participant_ids' not in doc.to_dict()]
+            if not legacy_refs:
+                return []
+
+            legacy = [doc.to_dict() for doc in await self._get_all_docs(legacy_refs) if doc.exists]
+            participants = await self._load_legacy_participants([data.get('id') for data in legacy])
+            for data in legacy:
+                data['participants'] = participants.get(data.get('id'), [])
+            return legacy
+
+        legacy = await _legacy_conversation_cache.get_or_load(f"legacy_{user_id}", load_legacy)
+        # Callers rewrite these dicts in place, so hand out copies of the cached ones
+        return deepcopy(legacy) if legacy else []
+
+    async def _get_all_docs(self, refs, field_paths: Optional[List[str]] = None) -> List[Any]:
+        """Read several documents in one get_all round trip"""
+        return [doc async for doc in self.db.get_all(refs, field_paths=field_paths)]
+
+    @staticmethod
+    async def _stream_docs(query) -> List[Any]:
+        """Drain a query stream into a list so several queries can be gathered"""
+        return [doc async for doc in query.stream()]
+
+    @staticmethod
+    def _participant_entry(user_id: str, user_name: str, user_role: str, joined_at: datetime) -> Dict[str, Any]:
+        """Participant record as embedded on the conversation document"""
+        return {
+            'user_id': user_id,
+            'user_name': user_name,
+            'user_role': user_role,
+            'joined_at': joined_at,
+            'is_active': True,
+            'last_read_at': None
+        }
 
     async def get_conversation_participants(self, conversation_id: str) -> List[ConversationParticipant]:
         """Get all participants for a conversation"""
         query = self.participants_collection.where('conversation_id', '==', conversation_id).where('is_active', '==', True)
-        docs = query.stream()
-        
         participants = []
-        for doc in docs:
-            data = doc.to_dict()
-            participants.append(ConversationParticipant(**data))
+        async for doc in query.stream():
+            participants.append(ConversationParticipant(**doc.to_dict()))
         
         return participants
 
@@ -563,19 +766,36 @@ class ConversationService:
     ) -> bool:
         """Update conversation's last message info"""
         try:
-            self.conversations_collection.document(conversation_id).update({
+            now = firestore.SERVER_TIMESTAMP
+            await self.conversations_collection.document(conversation_id).update({
                 'last_message_id': message_id,
                 'last_message_content': message_content[:100],  # Truncate for preview
                 'last_message_sender': sender_name,
-                'last_message_time': datetime.utcnow(),
-                'updated_at': datetime.utcnow(),
-                'total_messages': self.db.collection('messages').where('incident_id', '==', conversation_id).count()
+                'last_message_time': now,
+                'last_activity_at': now,
+                'updated_at': now,
+                # Blind increment - no read of the messages collection per write
+                'total_messages': firestore.Increment(1)
             })
+            _conversation_cache.invalidate(f"conv_{conversation_id}")
             return True
         except Exception as e:
-            print(f"Error updating last message: {e}")
+            log_sampled(logger, "update_last_message", logging.ERROR, "Error updating last message for %s: %s", conversation_id, e)
             return False
 
+    async def recount_messages(self, conversation_id: str) -> Optional[int]:
+        """Reconcile total_messages with the messages collection - for out-of-band repair, not the send path"""
+        try:
+            query = self.db.collection('messages').where('incident_id', '==', conversation_id)
+            snapshot = await query.count().get()
+            total = snapshot[0][0].value
+            await self.conversations_collection.document(conversation_id).update({'total_messages': total})
+            _conversation_cache.invalidate(f"conv_{conversation_id}")
+            return total
+        except Exception as e:
+            logger.error("Error recounting messages for %s: %s", conversation_id, e)
+            return None
+
     async def check_user_permission(
         self,
         conversation_id: str,
@@ -593,8 +813,20 @@ class ConversationService:
         if user_role == "security_team":
             return True
 
-        # For employees, just check if they're a participant - FAST query
-        participant_doc = self.participants_collection.document(f"{conversation_id}_{user_id}").get()
+        # For employees, answer from the cached conversation when we have it
+        cached = _conversation_cache.get(f"conv_{conversation_id}")
+        if cached:
+            return cached.has_participant(user_id)
+
+        # Then the membership cache, which also remembers negative answers
+        membership_key = f"mem_{conversation_id}_{user_id}"
+        is_member = _membership_cache.get(membership_key)
+        if is_member is not None:
+            return is_member
+
+        # Otherwise just check if they're a participant - FAST query
+        participant_doc = await self.participants_collection.document(f"{conversation_id}_{user_id}").get()
+        _membership_cache.set(membership_key, participant_doc.exists)
         return participant_doc.exists
 
     async def get_team_internal_conversations(self, user_role: str) -> List[ConversationResponse]:
@@ -604,25 +836,21 @@ class ConversationService:
 
         # Batch fetch all team_internal conversations
         query = self.conversations_collection.where('conversation_type', '==', ConversationType.TEAM_INTERNAL.value)
-        docs = list(query.stream())
+        conversations_data = [doc.to_dict() async for doc in query.stream()]
 
-        if not docs:
+        if not conversations_data:
             return []
 
-        conversations_data = [doc.to_dict() for doc in docs]
         conversation_ids = [data.get('id') for data in conversations_data]
 
-        # Batch load all participants for these conversations
-        all_participants = {}
-        for i in range(0, len(conversation_ids), 10):
-            batch_ids = conversation_ids[i:i+10]
-            participant_docs = self.participants_collection.where('conversation_id', 'in', batch_ids).stream()
-            for pdoc in participant_docs:
-                pdata = pdoc.to_dict()
-                conv_id = pdata.get('conversation_id')
-                if conv_id not in all_participants:
-                    all_participants[conv_id] = []
-                all_participants[conv_id].append(pdata)
+        # Participants are embedded on newer conversations; only legacy ones need a join
+        all_participants = {
+            data.get('id'): [p for p in data.get('participants', []) if p.get('is_active', True)]
+            for data in conversations_data if 'participant_ids' in data
+        }
+        legacy_ids = [conv_id for conv_id in conversation_ids if conv_id not in all_participants]
+
+        all_participants.update(await self._load_legacy_participants(legacy_ids))
 
         # Batch fetch user data for all participants
         all_user_ids = set()
@@ -637,9 +865,17 @@ class ConversationService:
 
         user_data_map = await self._batch_get_users(list(all_user_ids))
 
+        # Order on lightweight (sort key, data) tuples; models are built afterwards
+        ordered = sorted(
+            # updated_at is stamped on every write (and required by ConversationResponse)
+            ((data['updated_at'], data) for data in conversations_data if data.get('updated_at')),
+            key=lambda item: item[0],
+            reverse=True
+        )
+
         # Build conversation responses
         conversations = []
-        for data in conversations_data:
+        for _, data in ordered:
             try:
                 conv_id = data.get('id')
 
@@ -653,11 +889,11 @@ class ConversationService:
 
                 data['participants'] = participants
                 data['participant_count'] = len(participants)
-                data['conversation_type'] = ConversationType(data['conversation_type'])
-                data['status'] = ConversationStatus(data.get('status', 'active'))
+                data['conversation_type'] = _CONVERSATION_TYPES.get(data['conversation_type'])
+                data['status'] = _CONVERSATION_STATUSES.get(data.get('status', 'active'), ConversationStatus.ACTIVE)
 
                 conversations.append(ConversationResponse(**data))
             except Exception:
                 continue
 
-        return sorted(conversations, key=lambda x: x.updated_at or x.created_at, reverse=True)
\ No newline at end of file
+        return conversations
\ No newline at end of file
@@ -1,11 +1,158 @@
 from typing import Dict, List, Any, Optional
+import asyncio
 import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
-from datetime import datetime
+import random
+import time
+import aiohttp
+from datetime import datetime, timezone
 
 from app.core.firebase_config import FirebaseConfig
 
+SENDGRID_SEND_URL = "https://api.sendgrid.com/v3/mail/send"
+SENDGRID_TIMEOUT_SECONDS = 10
+# Firestore rejects batches with more than 500 writes
+BATCH_WRITE_LIMIT = 500
+# Fields returned by get_notification_history unless the caller asks for others
+NOTIFICATION_HISTORY_FIELDS = ['type', 'subject', 'status', 'sent_at']
+# SendGrid accepts at most 1000 personalizations per mail/send request
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+# Stay under SendGrid's request rate, and retry throttled or transient failures
+SENDGRID_REQUESTS_PER_SECOND = 100
+SENDGRID_MAX_RETRIES = 5
+SENDGRID_RETRY_STATUSES = {429, 500, 502, 503, 504}
+SENDGRID_MAX_BACKOFF_SECONDS = 30
+
+
+class _RateLimiter:
+    """Token bucket shared by all senders in the process"""
+
+    def __init__(self, rate: int, period: float = 1.0):
+        self._rate = rate
+        self._period = period
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._rate, self._tokens + (now - self._updated) * self._rate / self._period)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) * self._period / self._rate)
+
+
+_sendgrid_limiter = _RateLimiter(SENDGRID_REQUESTS_PER_SECOND)
+
+
+def _retry_delay(attempt: int, headers=None) -> float:
+    """Honor Retry-After / X-RateLimit-Reset when SendGrid sends them, else jittered exponential backoff"""
+    if headers:
+        try:
+            if headers.get('Retry-After'):
+                return min(float(headers['Retry-After']), SENDGRID_MAX_BACKOFF_SECONDS)
+            if headers.get('X-RateLimit-Reset'):
+                return min(max(float(headers['X-RateLimit-Reset']) - time.time(), 0), SENDGRID_MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+    return min(2 ** attempt, SENDGRID_MAX_BACKOFF_SECONDS) + random.random()
+
+
+# Incident email templates, built once at import: {notification_type: subject + body format strings}
+_INCIDENT_EMAIL_BODY = """
+                <h2>{heading}</h2>
+                <p><strong>Incident ID:</strong> {{incident_id}}</p>
+                <p><strong>Title:</strong> {{incident_title}}</p>
+                <p><strong>{time_label}:</strong> {{timestamp}}</p>
+                <p>{action}</p>
+                <br>
+                <p>This is an automated notification from Secura Security Platform.</p>
+                """
+
+
+def _incident_template(subject: str, heading: str, time_label: str, action: str) -> Dict[str, str]:
+    return {
+        'subject': subject,
+        'body': _INCIDENT_EMAIL_BODY.format(heading=heading, time_label=time_label, action=action)
+    }
+
+
+_INCIDENT_TEMPLATES = {
+    'new_incident': _incident_template(
+        "New Security Incident: {incident_title}", "New Security Incident Reported", "Reported",
+        "Please log in to the Secura platform to review and respond to this incident."
+    ),
+    'incident_assigned': _incident_template(
+        "Incident Assigned: {incident_title}", "Security Incident Assigned to You", "Assigned",
+        "Please log in to the Secura platform to begin investigation."
+    ),
+    'incident_resolved': _incident_template(
+        "Incident Resolved: {incident_title}", "Security Incident Resolved", "Resolved",
+        "The incident has been successfully resolved."
+    ),
+}
+_INCIDENT_UPDATE_TEMPLATE = _incident_template(
+    "Incident Update: {incident_title}", "Security Incident Update", "Updated",
+    "The incident status has been updated. Please check the platform for details."
+)
+
+_SEVERITY_COLORS = {
+    "low": "#28a745",
+    "medium": "#ffc107",
+    "high": "#fd7e14",
+    "critical": "#dc3545"
+}
+_DEFAULT_SEVERITY_COLOR = "#6c757d"
+
+_SECURITY_ALERT_BODY = """
+            <div style="border-left: 4px solid {color}; padding-left: 20px;">
+                <h2 style="color: {color};">Security Alert - {severity}</h2>
+                <h3>{title}</h3>
+                <p>{message}</p>
+                <p><strong>Alert Time:</strong> {timestamp}</p>
+                <p><strong>Severity:</strong> {severity}</p>
+            </div>
+            <br>
+            <p>Please review and take appropriate action.</p>
+            <p>This is an automated security alert from Secura Security Platform.</p>
+            """
+
+_COMPLIANCE_REPORT_BODY = """
+            <h2>{report_type} Compliance Report Ready</h2>
+            <p>Your requested compliance report has been generated and is ready for review.</p>
+            <p><strong>Report Type:</strong> {report_type}</p>
+            <p><strong>Generated:</strong> {timestamp}</p>
+            {download_link}
+            <br>
+            <p>This is an automated notification from Secura Security Platform.</p>
+            """
+_REPORT_DOWNLOAD_LINK = '<p><a href="{report_url}" style="color: #007bff;">Download Report</a></p>'
+
+
+# Shared across service instances so SendGrid connections are pooled and kept alive
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_http_session() -> aiohttp.ClientSession:
+    """Create the shared HTTP session lazily, once an event loop is running"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=50),
+            timeout=aiohttp.ClientTimeout(total=SENDGRID_TIMEOUT_SECONDS)
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """Close the shared HTTP session, e.g. on shutdown"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
 
 class NotificationService:
     """Service for handling notifications - Pramudi's Module"""
@@ -13,9 +160,39 @@ class NotificationService:
     def __init__(self):
         self.sendgrid_api_key = os.getenv('SENDGRID_API_KEY')
         self.from_email = os.getenv('FROM_EMAIL', 'noreply@secura.com')
-        self.sg = SendGridAPIClient(api_key=self.sendgrid_api_key) if self.sendgrid_api_key else None
         self.db = FirebaseConfig.get_firestore()
         self.notifications_collection = self.db.collection('notifications')
+
+    def _build_mail(self, recipients: List[str], subject: str, html_content: str) -> Dict[str, Any]:
+        """SendGrid v3 mail/send payload; each recipient gets their own personalization,
+        so nobody sees the other addresses"""
+        return {
+            'personalizations': [{'to': [{'email': recipient}]} for recipient in recipients],
+            'from': {'email': self.from_email},
+            'subject': subject,
+            'content': [{'type': 'text/html', 'value': html_content}]
+        }
+
+    async def _send_mail(self, payload: Dict[str, Any]) -> int:
+        """POST a payload to SendGrid without blocking the event loop; returns the HTTP status"""
+        for attempt in range(SENDGRID_MAX_RETRIES + 1):
+            await _sendgrid_limiter.acquire()
+            try:
+                async with _get_http_session().post(
+                    SENDGRID_SEND_URL,
+                    headers={'Authorization': f'Bearer {self.sendgrid_api_key}'},
+                    json=payload
+                ) as response:
+                    if response.status not in SENDGRID_RETRY_STATUSES or attempt == SENDGRID_MAX_RETRIES:
+                        return response.status
+                    delay = _retry_delay(attempt, response.headers)
+                    print(f"SendGrid returned {response.status}, retrying in {delay:.1f}s")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == SENDGRID_MAX_RETRIES:
+                    raise
+                delay = _retry_delay(attempt)
+                print(f"SendGrid request failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
     
     async def send_incident_notification(
         self, 
@@ -26,63 +203,23 @@ class NotificationService:
     ) -> bool:
         """Send email notification for incident updates"""
         try:
-            if not self.sg:
+            if not self.sendgrid_api_key:
                 print("SendGrid not configured, skipping email notification")
                 return False
             
+            now = datetime.now(timezone.utc)
+            
             # Create email content based on notification type
-            if notification_type == "new_incident":
-                subject = f"New Security Incident: {incident_title}"
-                content = f"""
-                <h2>New Security Incident Reported</h2>
-                <p><strong>Incident ID:</strong> {incident_id}</p>
-                <p><strong>Title:</strong> {incident_title}</p>
-                <p><strong>Reported:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <p>Please log in to the Secura platform to review and respond to this incident.</p>
-                <br>
-                <p>This is an automated notification from Secura Security Platform.</p>
-                """
-            elif notification_type == "incident_assigned":
-                subject = f"Incident Assigned: {incident_title}"
-                content = f"""
-                <h2>Security Incident Assigned to You</h2>
-                <p><strong>Incident ID:</strong> {incident_id}</p>
-                <p><strong>Title:</strong> {incident_title}</p>
-                <p><strong>Assigned:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <p>Please log in to the Secura platform to begin investigation.</p>
-                <br>
-                <p>This is an automated notification from Secura Security Platform.</p>
-                """
-            elif notification_type == "incident_resolved":
-                subject = f"Incident Resolved: {incident_title}"
-                content = f"""
-                <h2>Security Incident Resolved</h2>
-                <p><strong>Incident ID:</strong> {incident_id}</p>
-                <p><strong>Title:</strong> {incident_title}</p>
-                <p><strong>Resolved:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <p>The incident has been successfully resolved.</p>
-                <br>
-                <p>This is an automated notification from Secura Security Platform.</p>
-                """
-            else:
-                subject = f"Incident Update: {incident_title}"
-                content = f"""
-                <h2>Security Incident Update</h2>
-                <p><strong>Incident ID:</strong> {incident_id}</p>
-                <p><strong>Title:</strong> {incident_title}</p>
-                <p><strong>Updated:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <p>The incident status has been updated. Please check the platform for details.</p>
-                <br>
-                <p>This is an automated notification from Secura Security Platform.</p>
-                """
+            template = _INCIDENT_TEMPLATES.get(notification_type, _INCIDENT_UPDATE_TEMPLATE)
+            subject = template['subject'].format(incident_title=incident_title)
+            content = template['body'].format(
+                incident_id=incident_id,
+                incident_title=incident_title,
+                timestamp=now.isoformat(timespec='seconds')
+            )
             
             # Create and send email
-            from_email = Email(self.from_email)
-            to_email = To(recipient_email)
-            content = Content("text/html", content)
-            mail = Mail(from_email, to_email, subject, content)
-            
-            response = self.sg.send(mail)
+            status_code = await self._send_mail(self._build_mail([recipient_email], subject, content))
             
             # Log notification in Firestore
             await self._log_notification({
@@ -90,11 +227,11 @@ class NotificationService:
                 'recipient': recipient_email,
                 'subject': subject,
                 'incident_id': incident_id,
-                'status': 'sent' if response.status_code == 202 else 'failed',
-                'sent_at': datetime.utcnow()
+                'status': 'sent' if status_code == 202 else 'failed',
+                'sent_at': now
             })
             
-            return response.status_code == 202
+            return status_code == 202
             
         except Exception as e:
             print(f"Failed to send email notification: {e}")
@@ -109,48 +246,51 @@ class NotificationService:
     ) -> bool:
         """Send security alert to security team"""
         try:
-            if not self.sg or not recipients:
+            if not self.sendgrid_api_key or not recipients:
                 return False
             
             # Determine email styling based on severity
-            severity_colors = {
-                "low": "#28a745",
-                "medium": "#ffc107", 
-                "high": "#fd7e14",
-                "critical": "#dc3545"
-            }
-            
-            color = severity_colors.get(severity.lower(), "#6c757d")
+            color = _SEVERITY_COLORS.get(severity.lower(), _DEFAULT_SEVERITY_COLOR)
+            now = datetime.now(timezone.utc)
             
             subject = f"[{severity.upper()}] Security Alert: {title}"
-            content = f"""
-            <div style="border-left: 4px solid {color}; padding-left: 20px;">
-                <h2 style="color: {color};">Security Alert - {severity.upper()}</h2>
-                <h3>{title}</h3>
-                <p>{message}</p>
-                <p><strong>Alert Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <p><strong>Severity:</strong> {severity.upper()}</p>
-            </div>
-            <br>
-            <p>Please review and take appropriate action.</p>
-            <p>This is an automated security alert from Secura Security Platform.</p>
-            """
+            content = _SECURITY_ALERT_BODY.format(
+                color=color,
+                severity=severity.upper(),
+                title=title,
+                message=message,
+                timestamp=now.isoformat(timespec='seconds')
+            )
             
-            # Send to all recipients
+            # The body is identical for everyone, so send one request per batch of
+            # recipients instead of one per recipient, with the batches in flight together
+            batches = [
+                recipients[i:i + SENDGRID_MAX_PERSONALIZATIONS]
+                for i in range(0, len(recipients), SENDGRID_MAX_PERSONALIZATIONS)
+            ]
+            results = await asyncio.gather(
+                *[self._send_mail(self._build_mail(batch, subject, content)) for batch in batches],
+                return_exceptions=True
+            )
             success_count = 0
-            for recipient in recipients:
-                try:
-                    from_email = Email(self.from_email)
-                    to_email = To(recipient)
-                    mail_content = Content("text/html", content)
-                    mail = Mail(from_email, to_email, subject, mail_content)
-                    
-                    response = self.sg.send(mail)
-                    if response.status_code == 202:
-                        success_count += 1
-                        
-                except Exception as e:
-                    print(f"Failed to send alert to {recipient}: {e}")
+            log_entries = []
+            for batch, result in zip(batches, results):
+                if isinstance(result, Exception):
+                    print(f"Failed to send alert to {len(batch)} recipients: {result}")
+                elif result == 202:
+                    success_count += len(batch)
+                status = 'sent' if result == 202 else 'failed'
+                log_entries.extend({
+                    'type': 'security_alert',
+                    'recipient': recipient,
+                    'subject': subject,
+                    'severity': severity,
+                    'status': status,
+                    'sent_at': now
+                } for recipient in batch)
+            
+            # Log every recipient in batched writes rather than one write each
+            await self._log_notifications(log_entries)
             
             return success_count > 0
             
@@ -166,32 +306,19 @@ class NotificationService:
     ) -> bool:
         """Send notification for generated compliance reports"""
         try:
-            if not self.sg:
+            if not self.sendgrid_api_key:
                 return False
             
+            now = datetime.now(timezone.utc)
             subject = f"{report_type.upper()} Compliance Report Generated"
-            content = f"""
-            <h2>{report_type.upper()} Compliance Report Ready</h2>
-            <p>Your requested compliance report has been generated and is ready for review.</p>
-            <p><strong>Report Type:</strong> {report_type.upper()}</p>
-            <p><strong>Generated:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-            """
+            content = _COMPLIANCE_REPORT_BODY.format(
+                report_type=report_type.upper(),
+                timestamp=now.isoformat(timespec='seconds'),
+                download_link=_REPORT_DOWNLOAD_LINK.format(report_url=report_url) if report_url else ''
+            )
             
-            if report_url:
-                content += f'<p><a href="{report_url}" style="color: #007bff;">Download Report</a></p>'
-            
-            content += """
-            <br>
-            <p>This is an automated notification from Secura Security Platform.</p>
-            """
-            
-            from_email = Email(self.from_email)
-            to_email = To(recipient_email)
-            mail_content = Content("text/html", content)
-            mail = Mail(from_email, to_email, subject, mail_content)
-            
-            response = self.sg.send(mail)
-            return response.status_code == 202
+            status_code = await self._send_mail(self._build_mail([recipient_email], subject, content))
+            return status_code == 202
             
         except Exception as e:
             print(f"Failed to send compliance report notification: {e}")
@@ -208,6 +335,8 @@ class NotificationService:
         # This would integrate with Firebase Cloud Messaging
         # For now, return a placeholder response
         try:
+            now = datetime.now(timezone.utc)
+            
             # Store notification in Firestore for real-time updates
             await self._log_notification({
                 'type': 'push',
@@ -216,12 +345,12 @@ class NotificationService:
                 'body': body,
                 'data': data or {},
                 'status': 'sent',
-                'sent_at': datetime.utcnow()
+                'sent_at': now
             })
             
             return {
                 'success': True,
-                'message_id': f'push_{user_id}_{int(datetime.now().timestamp())}'
+                'message_id': f'push_{user_id}_{int(now.timestamp())}'
             }
             
         except Exception as e:
@@ -231,32 +360,59 @@ class NotificationService:
     async def get_notification_history(
         self, 
         user_id: Optional[str] = None, 
-        limit: int = 50
-    ) -> List[Dict[str, Any]]:
-        """Get notification history"""
+        limit: int = 50,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Get a page of notification history: {'items': [...], 'next_cursor': id or None}"""
         try:
-            query = self.notifications_collection.order_by('sent_at', direction='desc').limit(limit)
+            query = self.notifications_collection.order_by('sent_at', direction='desc')
             
             if user_id:
                 query = query.where('user_id', '==', user_id)
             
-            docs = query.stream()
-            notifications = []
+            # Only fetch the fields the caller shows, not full audit documents
+            query = query.select(fields or NOTIFICATION_HISTORY_FIELDS).limit(limit)
             
-            for doc in docs:
-                notification_data = doc.to_dict()
-                notification_data['id'] = doc.id
-                notifications.append(notification_data)
+            def read_history():
+                page_query = query
+                if start_after:
+                    cursor = self.notifications_collection.document(start_after).get()
+                    if cursor.exists:
+                        page_query = page_query.start_after(cursor)
+                
+                notifications = []
+                for doc in page_query.stream():
+                    notification_data = doc.to_dict()
+                    notification_data['id'] = doc.id
+                    notifications.append(notification_data)
+                return notifications
             
-            return notifications
+            loop = asyncio.get_running_loop()
+            notifications = await loop.run_in_executor(None, read_history)
+            # A short page means there is nothing after it
+            next_cursor = notifications[-1]['id'] if len(notifications) == limit else None
+            return {'items': notifications, 'next_cursor': next_cursor}
             
         except Exception as e:
             print(f"Failed to get notification history: {e}")
-            return []
+            return {'items': [], 'next_cursor': None}
     
     async def _log_notification(self, notification_data: Dict[str, Any]) -> None:
         """Log notification to Firestore for audit trail"""
+        await self._log_notifications([notification_data])
+
+    async def _log_notifications(self, entries: List[Dict[str, Any]]) -> None:
+        """Log several notifications in WriteBatch commits of at most 500 writes"""
+        def commit_batches():
+            for i in range(0, len(entries), BATCH_WRITE_LIMIT):
+                batch = self.db.batch()
+                for entry in entries[i:i + BATCH_WRITE_LIMIT]:
+                    batch.set(self.notifications_collection.document(), entry)
+                batch.commit()
+
         try:
-            self.notifications_collection.add(notification_data)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, commit_batches)
         except Exception as e:
             print(f"Failed to log notification: {e}")
\ No newline at end of file
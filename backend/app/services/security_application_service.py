@@ -3,24 +3,33 @@ Security Team Application Service
 Handles security team applications and approvals
 """
 
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Dict, Any
+from datetime import datetime, timezone
+import asyncio
 import uuid
 
 from app.core.firebase_config import FirebaseConfig
 from app.models.security_application import SecurityTeamApplication, ApplicationStatus, ApplicationCreate, ApplicationReview
 from app.models.common import UserRole
 from app.services.auth.auth_service import AuthService
+from app.utils.cache import TTLCache
+
+
+# Short-lived caches of applicant data so dashboard refreshes don't re-read the same users
+_applicant_name_cache = TTLCache(ttl_seconds=60, max_size=1024)  # uid -> full_name
+_applicant_profile_cache = TTLCache(ttl_seconds=60, max_size=1024)  # uid -> User
 
 class SecurityApplicationService:
     def __init__(self):
         self.db = FirebaseConfig.get_firestore()
         self.applications_collection = self.db.collection('security_applications')
+        self.users_collection = self.db.collection('users')
         self.auth_service = AuthService()
 
     async def create_application(self, applicant_uid: str, application_data: ApplicationCreate) -> str:
         """Create a new security team application"""
         application_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
         
         application = SecurityTeamApplication(
             id=application_id,
@@ -30,19 +39,21 @@ class SecurityApplicationService:
             certifications=application_data.certifications,
             proof_documents=application_data.proof_documents,
             status=ApplicationStatus.PENDING,
-            created_at=datetime.utcnow()
+            created_at=now
         )
         
         # Store in Firestore
         app_data = application.dict()
-        app_data['created_at'] = datetime.utcnow()
+        app_data['created_at'] = now
         
-        self.applications_collection.document(application_id).set(app_data)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.applications_collection.document(application_id).set, app_data)
         return application_id
 
     async def get_application(self, application_id: str) -> Optional[SecurityTeamApplication]:
         """Get application by ID"""
-        doc = self.applications_collection.document(application_id).get()
+        loop = asyncio.get_running_loop()
+        doc = await loop.run_in_executor(None, self.applications_collection.document(application_id).get)
         
         if not doc.exists:
             return None
@@ -52,72 +63,90 @@ class SecurityApplicationService:
 
     async def get_user_applications(self, user_uid: str) -> List[SecurityTeamApplication]:
         """Get all applications for a specific user"""
-        docs = self.applications_collection.where('applicant_uid', '==', user_uid).stream()
-        applications = []
-        
-        for doc in docs:
-            data = doc.to_dict()
-            applications.append(SecurityTeamApplication(**data))
-        
-        return applications
+        query = self.applications_collection.where('applicant_uid', '==', user_uid)
+        return await self._query_applications(query)
 
     async def get_pending_applications(self) -> List[SecurityTeamApplication]:
         """Get all pending applications (Admin only)"""
-        docs = self.applications_collection.where('status', '==', ApplicationStatus.PENDING.value).stream()
-        applications = []
-        
-        for doc in docs:
-            data = doc.to_dict()
-            application = SecurityTeamApplication(**data)
-            
-            # Fetch applicant name
-            try:
-                user_profile = await self.auth_service.get_user_profile(application.applicant_uid)
-                application.applicant_name = user_profile.full_name if user_profile else "Unknown User"
-            except Exception:
-                application.applicant_name = "Unknown User"
-            
-            applications.append(application)
-        
+        query = self.applications_collection.where('status', '==', ApplicationStatus.PENDING.value)
+        applications = await self._query_applications(query)
+        await self._attach_applicant_names(applications)
         return applications
 
     async def get_all_applications(self) -> List[SecurityTeamApplication]:
         """Get all applications regardless of status (Admin only)"""
-        docs = self.applications_collection.order_by('created_at', direction='DESCENDING').stream()
-        applications = []
-        
-        for doc in docs:
-            data = doc.to_dict()
-            application = SecurityTeamApplication(**data)
-            
-            # Fetch applicant name
-            try:
-                user_profile = await self.auth_service.get_user_profile(application.applicant_uid)
-                application.applicant_name = user_profile.full_name if user_profile else "Unknown User"
-            except Exception:
-                application.applicant_name = "Unknown User"
-            
-            applications.append(application)
-        
+        query = self.applications_collection.order_by('created_at', direction='DESCENDING')
+        applications = await self._query_applications(query)
+        await self._attach_applicant_names(applications)
         return applications
 
+    async def _query_applications(self, query) -> List[SecurityTeamApplication]:
+        """Stream a query in the executor so the event loop isn't blocked"""
+        def read_applications():
+            return [SecurityTeamApplication(**doc.to_dict()) for doc in query.stream()]
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, read_applications)
+
+    async def _attach_applicant_names(self, applications: List[SecurityTeamApplication]):
+        """Fill in applicant names, reading each distinct applicant once"""
+        names = await self._get_applicant_names(list({a.applicant_uid for a in applications}))
+        for application in applications:
+            application.applicant_name = names.get(application.applicant_uid, "Unknown User")
+
+    async def _get_applicant_names(self, uids: List[str]) -> Dict[str, str]:
+        """Read applicant names, cache misses in one get_all round trip: {uid: full_name}"""
+        names = {}
+        missing = []
+        for uid in uids:
+            cached = _applicant_name_cache.get(uid)
+            if cached is not None:
+                names[uid] = cached
+            else:
+                missing.append(uid)
+        if not missing:
+            return names
+
+        def read_names():
+            refs = [self.users_collection.document(uid) for uid in missing]
+            return {
+                doc.id: doc.to_dict().get('full_name', "Unknown User")
+                for doc in self.db.get_all(refs, field_paths=['full_name'])
+                if doc.exists
+            }
+
+        try:
+            loop = asyncio.get_running_loop()
+            fetched = await loop.run_in_executor(None, read_names)
+        except Exception:
+            return names
+
+        for uid, name in fetched.items():
+            _applicant_name_cache.set(uid, name)
+        names.update(fetched)
+        return names
+
     async def review_application(self, application_id: str, review_data: ApplicationReview, admin_uid: str) -> bool:
         """Review and approve/reject application"""
         try:
             update_data = {
                 'status': review_data.status.value,
                 'admin_notes': review_data.admin_notes,
-                'reviewed_at': datetime.utcnow(),
+                'reviewed_at': datetime.now(timezone.utc),
                 'reviewed_by': admin_uid
             }
             
-            self.applications_collection.document(application_id).update(update_data)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.applications_collection.document(application_id).update, update_data)
             
             # If approved, update user role
             if review_data.status == ApplicationStatus.APPROVED:
                 application = await self.get_application(application_id)
                 if application:
                     await self.auth_service.assign_security_role(application.applicant_uid)
+                    # The applicant's role just changed
+                    _applicant_profile_cache.invalidate(application.applicant_uid)
+                    _applicant_name_cache.invalidate(application.applicant_uid)
             
             return True
         except Exception:
@@ -125,14 +154,20 @@ class SecurityApplicationService:
 
     async def can_user_apply(self, user_uid: str) -> bool:
         """Check if user can submit a new application"""
-        # Check if user already has a pending application
-        pending_apps = self.applications_collection.where('applicant_uid', '==', user_uid).where('status', '==', ApplicationStatus.PENDING.value).stream()
-        
-        for _ in pending_apps:
+        # Check if user already has a pending application - a server-side count
+        # capped at one, so no application documents are transferred
+        pending_query = self.applications_collection.where('applicant_uid', '==', user_uid).where('status', '==', ApplicationStatus.PENDING.value)
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, pending_query.limit(1).count().get)
+        if snapshot[0][0].value > 0:
             return False  # User already has a pending application
         
         # Check if user is already security team or admin
-        user = await self.auth_service.get_user_profile(user_uid)
+        user = _applicant_profile_cache.get(user_uid)
+        if user is None:
+            user = await self.auth_service.get_user_profile(user_uid)
+            if user:
+                _applicant_profile_cache.set(user_uid, user)
         if user and user.role in [UserRole.SECURITY_TEAM, UserRole.ADMIN]:
             return False
         
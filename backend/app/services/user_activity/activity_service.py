@@ -2,15 +2,148 @@
 User Activity Service - Track user online status and activity
 """
 
-from datetime import datetime, timedelta
-from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
 from app.core.firebase_config import FirebaseConfig
 from app.models.user_activity import UserActivity, UserStatus, ActivityType, OnlineStatusResponse, TeamStatusResponse
 from app.models.common import UserRole
+from collections import OrderedDict
+import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+ACTIVITY_FLUSH_INTERVAL_SECONDS = 0.25
+# Each event is two writes (activity + status); a WriteBatch holds at most 500
+ACTIVITY_FLUSH_MAX_EVENTS = 250
+
+# user_activities docs carry expire_at so a Firestore TTL policy can delete them
+ACTIVITY_RETENTION_DAYS = 30
+
+STATUS_CACHE_TTL_SECONDS = 5
+# Heartbeats and API calls refresh the status at most this often per user;
+# the online threshold is minutes, so finer updates change nothing
+STATUS_WRITE_INTERVAL_SECONDS = 60
+STATUS_WRITE_TRACK_MAX_USERS = 10_000
+# The team dashboard polls; its answer only moves on the scale of minutes
+TEAM_STATUS_CACHE_TTL_SECONDS = 10
+
+# (activity_ref, activity_data, status_ref, status_data); status is None when skipped
+ActivityEvent = Tuple[Any, Dict[str, Any], Optional[Any], Optional[Dict[str, Any]]]
+
+# Module-level so the queue and caches outlive the per-request service
+_activity_queue: Optional[asyncio.Queue] = None
+_flush_task: Optional[asyncio.Task] = None
+# {user_id: (fetched_at, status)} on the monotonic clock
+_status_cache: Dict[str, Tuple[float, Optional[UserStatus]]] = {}
+# (computed_at, response) for get_team_online_status
+_team_status_cache: Optional[Tuple[float, TeamStatusResponse]] = None
+# {user_id: monotonic time of the last queued status write}, oldest first
+_last_status_write: "OrderedDict[str, float]" = OrderedDict()
+
+
+def _should_write_status(user_id: str, activity_type: ActivityType) -> bool:
+    """Login/logout always write; heartbeats and API calls at most once per interval"""
+    now = time.monotonic()
+    if activity_type == ActivityType.LOGOUT:
+        # The next heartbeat must write, or the user would stay offline
+        _last_status_write.pop(user_id, None)
+        return True
+    if activity_type != ActivityType.LOGIN:
+        last_write = _last_status_write.get(user_id)
+        if last_write is not None and now - last_write < STATUS_WRITE_INTERVAL_SECONDS:
+            return False
+    _last_status_write[user_id] = now
+    _last_status_write.move_to_end(user_id)
+    if len(_last_status_write) > STATUS_WRITE_TRACK_MAX_USERS:
+        _last_status_write.popitem(last=False)
+    return True
+
+
+def _ensure_flusher(db):
+    """Start the activity flush loop if it is not already running"""
+    global _activity_queue, _flush_task
+    if _activity_queue is None:
+        _activity_queue = asyncio.Queue()
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_activities(db))
+    return _activity_queue
+
+
+def _drain_queue(limit: int) -> List[ActivityEvent]:
+    events = []
+    while _activity_queue is not None and len(events) < limit and not _activity_queue.empty():
+        events.append(_activity_queue.get_nowait())
+    return events
+
+
+async def _commit_events(db, events: List[ActivityEvent]):
+    """Write a group of activity events in one batch"""
+    batch = db.batch()
+    # Fold each user's status updates into one merge; later fields win, as they
+    # would have with one write per event
+    statuses: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+    for activity_ref, activity_data, status_ref, status_data in events:
+        batch.set(activity_ref, activity_data)
+        if status_ref is None:
+            continue
+        if status_ref.id in statuses:
+            statuses[status_ref.id][1].update(status_data)
+        else:
+            statuses[status_ref.id] = (status_ref, dict(status_data))
+    for status_ref, status_data in statuses.values():
+        batch.set(status_ref, status_data, merge=True)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, batch.commit)
+    except Exception as e:
+        logger.error(f"Error flushing {len(events)} user activities: {str(e)}")
+        # Let the next heartbeat retry the status write
+        for user_id in statuses:
+            _last_status_write.pop(user_id, None)
+    finally:
+        # A read may have re-cached the old status while the write was queued
+        for user_id in statuses:
+            _status_cache.pop(user_id, None)
+
+
+async def _flush_activities(db):
+    """Coalesce queued activity events and flush them every 250ms or 250 events"""
+    loop = asyncio.get_running_loop()
+    while True:
+        events = [await _activity_queue.get()]
+        deadline = loop.time() + ACTIVITY_FLUSH_INTERVAL_SECONDS
+        try:
+            while len(events) < ACTIVITY_FLUSH_MAX_EVENTS:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    events.append(await asyncio.wait_for(_activity_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Don't drop events already taken off the queue
+            await _commit_events(db, events)
+            raise
+        await _commit_events(db, events)
+
+
+async def flush_pending_activities():
+    """Write out anything still queued, e.g. on shutdown"""
+    if _flush_task is not None and not _flush_task.done():
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+    db = FirebaseConfig.get_firestore()
+    while True:
+        events = _drain_queue(ACTIVITY_FLUSH_MAX_EVENTS)
+        if not events:
+            break
+        await _commit_events(db, events)
+
 class UserActivityService:
     def __init__(self):
         self.db = FirebaseConfig.get_firestore()
@@ -24,25 +157,33 @@ class UserActivityService:
         user_agent: Optional[str] = None,
         endpoint: Optional[str] = None
     ) -> bool:
-        """Track user activity in database"""
+        """Queue user activity; writes are batched by the background flusher"""
         try:
+            now = datetime.now(timezone.utc)
             activity = UserActivity(
                 user_id=user_id,
                 activity_type=activity_type,
-                timestamp=datetime.utcnow(),
+                timestamp=now,
                 ip_address=ip_address,
                 user_agent=user_agent,
                 endpoint=endpoint
             )
             
-            # Store activity in user_activities collection
+            # Document IDs are generated client-side, so no RPC happens here
             activity_ref = self.db.collection('user_activities').document()
             activity_data = activity.dict()
             activity_data['id'] = activity_ref.id
-            activity_ref.set(activity_data)
-            
-            # Update user status
-            await self._update_user_status(user_id, activity_type)
+            activity_data['expire_at'] = now + timedelta(days=ACTIVITY_RETENTION_DAYS)
+
+            status_ref = status_data = None
+            if _should_write_status(user_id, activity_type):
+                status_ref = self.db.collection('user_status').document(user_id)
+                status_data = await self._build_status_data(status_ref, user_id, activity_type, now)
+
+            queue = _ensure_flusher(self.db)
+            await queue.put((activity_ref, activity_data, status_ref, status_data))
+            if status_ref is not None:
+                _status_cache.pop(user_id, None)
             
             logger.info(f"Tracked activity for user {user_id}: {activity_type}")
             return True
@@ -51,57 +192,54 @@ class UserActivityService:
             logger.error(f"Error tracking user activity: {str(e)}")
             return False
     
-    async def _update_user_status(self, user_id: str, activity_type: ActivityType):
-        """Update user's current status"""
-        try:
-            now = datetime.utcnow()
-            user_status_ref = self.db.collection('user_status').document(user_id)
-            
-            # Get existing status
-            status_doc = user_status_ref.get()
-            
-            if activity_type == ActivityType.LOGIN:
-                status_data = {
-                    'user_id': user_id,
-                    'is_online': True,
-                    'last_activity': now,
-                    'last_login': now,
-                    'last_logout': None
-                }
-            elif activity_type == ActivityType.LOGOUT:
-                existing_data = status_doc.to_dict() if status_doc.exists else {}
-                last_login = existing_data.get('last_login')
-                session_duration = None
-                if last_login:
-                    session_duration = int((now - last_login.replace(tzinfo=None)).total_seconds() / 60)
-                
-                status_data = {
-                    'user_id': user_id,
-                    'is_online': False,
-                    'last_activity': now,
-                    'last_logout': now,
-                    'session_duration': session_duration
-                }
-            else:  # HEARTBEAT or API_CALL
-                status_data = {
-                    'user_id': user_id,
-                    'is_online': True,
-                    'last_activity': now
-                }
+    async def _build_status_data(self, status_ref, user_id: str, activity_type: ActivityType, now: datetime) -> Dict[str, Any]:
+        """Build the user's status update for an activity"""
+        if activity_type == ActivityType.LOGIN:
+            return {
+                'user_id': user_id,
+                'is_online': True,
+                'last_activity': now,
+                'last_activity_epoch': int(now.timestamp()),
+                'last_login': now,
+                'last_logout': None
+            }
+        if activity_type == ActivityType.LOGOUT:
+            # Only logout needs the existing status, to compute the session length
+            status_doc = await asyncio.get_running_loop().run_in_executor(None, status_ref.get)
+            existing_data = status_doc.to_dict() if status_doc.exists else {}
+            last_login = existing_data.get('last_login')
+            session_duration = None
+            if last_login:
+                session_duration = int((now - last_login).total_seconds() / 60)
             
-            user_status_ref.set(status_data, merge=True)
-            
-        except Exception as e:
-            logger.error(f"Error updating user status: {str(e)}")
+            return {
+                'user_id': user_id,
+                'is_online': False,
+                'last_activity': now,
+                'last_activity_epoch': int(now.timestamp()),
+                'last_logout': now,
+                'session_duration': session_duration
+            }
+        # HEARTBEAT or API_CALL
+        return {
+            'user_id': user_id,
+            'is_online': True,
+            'last_activity': now,
+            'last_activity_epoch': int(now.timestamp())
+        }
     
     async def get_user_status(self, user_id: str) -> Optional[UserStatus]:
-        """Get current status of a specific user"""
+        """Get current status of a specific user - CACHED"""
+        cached = _status_cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < STATUS_CACHE_TTL_SECONDS:
+            return cached[1]
+
         try:
-            status_doc = self.db.collection('user_status').document(user_id).get()
-            if status_doc.exists:
-                data = status_doc.to_dict()
-                return UserStatus(**data)
-            return None
+            status_ref = self.db.collection('user_status').document(user_id)
+            status_doc = await asyncio.get_running_loop().run_in_executor(None, status_ref.get)
+            status = UserStatus(**status_doc.to_dict()) if status_doc.exists else None
+            _status_cache[user_id] = (time.monotonic(), status)
+            return status
         except Exception as e:
             logger.error(f"Error getting user status: {str(e)}")
             return None
@@ -115,7 +253,7 @@ class UserActivityService:
             
             # Check if user is marked online and last activity was within threshold
             if status.is_online:
-                time_diff = datetime.utcnow() - status.last_activity.replace(tzinfo=None)
+                time_diff = datetime.now(timezone.utc) - status.last_activity
                 return time_diff.total_seconds() < (self.online_threshold_minutes * 60)
             
             return False
@@ -124,38 +262,48 @@ class UserActivityService:
             return False
     
     async def get_team_online_status(self) -> TeamStatusResponse:
-        """Get online status of all security team members"""
+        """Get online status of all security team members - CACHED"""
+        global _team_status_cache
+        if _team_status_cache and time.monotonic() - _team_status_cache[0] < TEAM_STATUS_CACHE_TTL_SECONDS:
+            return _team_status_cache[1]
+
         try:
+            loop = asyncio.get_running_loop()
+
             # Get only security team members (excluding admin)
             users_ref = self.db.collection('users')
-            security_members_query = users_ref.where('role', '==', 'security_team').where('is_active', '==', True)
-            security_members = list(security_members_query.stream())
+            # Only the fields the response shows, not full profiles
+            security_members_query = (
+                users_ref.where('role', '==', 'security_team').where('is_active', '==', True)
+                .select(['uid', 'email', 'full_name', 'role'])
+            )
+            security_members = await loop.run_in_executor(None, lambda: list(security_members_query.stream()))
 
             if not security_members:
                 return TeamStatusResponse(total_members=0, online_members=0, members=[])
 
+            # Deserialize each member once; only members with a uid are reported
+            members_data = [data for data in (m.to_dict() for m in security_members) if data.get('uid')]
+
             # PERFORMANCE FIX: Batch load all user statuses in one query
-            member_ids = [m.to_dict().get('uid') for m in security_members if m.to_dict().get('uid')]
+            member_ids = [data['uid'] for data in members_data]
+
+            # Status docs are keyed by uid, so read them all in one get_all round trip
+            status_collection = self.db.collection('user_status')
+            status_refs = [status_collection.document(uid) for uid in member_ids]
+
+            def fetch_statuses():
+                return {doc.id: doc.to_dict() for doc in self.db.get_all(status_refs) if doc.exists}
 
-            # Batch fetch all user statuses (Firestore 'in' limit is 10)
-            all_statuses = {}
-            for i in range(0, len(member_ids), 10):
-                batch_ids = member_ids[i:i+10]
-                status_docs = self.db.collection('user_status').where('user_id', 'in', batch_ids).stream()
-                for doc in status_docs:
-                    data = doc.to_dict()
-                    all_statuses[data.get('user_id')] = data
+            all_statuses = await loop.run_in_executor(None, fetch_statuses)
 
             team_members = []
             online_count = 0
-            now = datetime.utcnow()
-            threshold_seconds = self.online_threshold_minutes * 60
+            now = datetime.now(timezone.utc)
+            online_cutoff_epoch = int(now.timestamp()) - self.online_threshold_minutes * 60
 
-            for member_doc in security_members:
-                member_data = member_doc.to_dict()
-                user_id = member_data.get('uid')
-                if not user_id:
-                    continue
+            for member_data in members_data:
+                user_id = member_data['uid']
 
                 # Get status from batch-loaded data
                 status_data = all_statuses.get(user_id)
@@ -168,13 +316,12 @@ class UserActivityService:
                 if status_data:
                     last_activity = status_data.get('last_activity', now)
                     last_login = status_data.get('last_login')
-                    if status_data.get('is_online') and last_activity:
-                        try:
-                            activity_time = last_activity.replace(tzinfo=None) if hasattr(last_activity, 'replace') else last_activity
-                            time_diff = (now - activity_time).total_seconds()
-                            is_online = time_diff < threshold_seconds
-                        except:
-                            is_online = False
+                    if status_data.get('is_online'):
+                        activity_epoch = status_data.get('last_activity_epoch')
+                        if activity_epoch is None and last_activity:
+                            # Status written before the epoch field existed
+                            activity_epoch = last_activity.timestamp()
+                        is_online = (activity_epoch or 0) > online_cutoff_epoch
 
                 if is_online:
                     online_count += 1
@@ -190,11 +337,13 @@ class UserActivityService:
                 )
                 team_members.append(member_status)
 
-            return TeamStatusResponse(
+            team_status = TeamStatusResponse(
                 total_members=len(team_members),
                 online_members=online_count,
                 members=team_members
             )
+            _team_status_cache = (time.monotonic(), team_status)
+            return team_status
 
         except Exception as e:
             logger.error(f"Error getting team online status: {str(e)}")
@@ -204,29 +353,25 @@ class UserActivityService:
                 members=[]
             )
     
-    async def cleanup_old_activities(self, days_to_keep: int = 30):
-        """Clean up old activity records"""
+    async def cleanup_old_activities(self, days_to_keep: int = ACTIVITY_RETENTION_DAYS):
+        """Clean up old activity records the TTL policy hasn't removed (e.g. ones without expire_at)"""
         try:
-            cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
+            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_to_keep)
             
             activities_ref = self.db.collection('user_activities')
-            old_activities = activities_ref.where('timestamp', '<', cutoff_date).stream()
-            
-            batch = self.db.batch()
-            count = 0
             
-            for activity_doc in old_activities:
-                batch.delete(activity_doc.reference)
-                count += 1
+            def delete_old_activities():
+                # Only references are needed, so skip downloading document bodies
+                old_activities = activities_ref.where('timestamp', '<', cutoff_date).select(['__name__']).stream()
                 
-                # Firestore batch limit is 500
-                if count >= 500:
-                    batch.commit()
-                    batch = self.db.batch()
-                    count = 0
+                # BulkWriter batches, parallelizes and backs off on its own, which
+                # suits an unbounded purge better than fixed 500-write batches
+                bulk_writer = self.db.bulk_writer()
+                for activity_doc in old_activities:
+                    bulk_writer.delete(activity_doc.reference)
+                bulk_writer.close()
             
-            if count > 0:
-                batch.commit()
+            await asyncio.get_running_loop().run_in_executor(None, delete_old_activities)
             
             logger.info(f"Cleaned up old user activities older than {days_to_keep} days")
             
@@ -236,30 +381,33 @@ class UserActivityService:
     async def update_offline_users(self):
         """Mark users as offline if they haven't been active"""
         try:
-            cutoff_time = datetime.utcnow() - timedelta(minutes=self.online_threshold_minutes)
+            now = datetime.now(timezone.utc)
+            cutoff_time = now - timedelta(minutes=self.online_threshold_minutes)
             
-            # Get all users marked as online
+            # Only users marked online whose last activity is past the cutoff;
+            # the filter runs server-side and no fields are needed back
             status_ref = self.db.collection('user_status')
-            online_users = status_ref.where('is_online', '==', True).stream()
-            
-            batch = self.db.batch()
-            count = 0
+            stale_query = status_ref.where('is_online', '==', True).where('last_activity', '<', cutoff_time).select(['__name__'])
             
-            for status_doc in online_users:
-                status_data = status_doc.to_dict()
-                last_activity = status_data.get('last_activity')
-                
-                if last_activity and last_activity.replace(tzinfo=None) < cutoff_time:
-                    # Mark user as offline
-                    batch.update(status_doc.reference, {
+            def mark_offline():
+                # BulkWriter splits and retries the updates, so any number of stale users fits
+                bulk_writer = self.db.bulk_writer()
+                offline_ids = []
+                for status_doc in stale_query.stream():
+                    bulk_writer.update(status_doc.reference, {
                         'is_online': False,
-                        'last_logout': datetime.utcnow()
+                        'last_logout': now
                     })
-                    count += 1
+                    offline_ids.append(status_doc.id)
+                bulk_writer.close()
+                return offline_ids
+            
+            offline_ids = await asyncio.get_running_loop().run_in_executor(None, mark_offline)
             
-            if count > 0:
-                batch.commit()
-                logger.info(f"Marked {count} inactive users as offline")
+            if offline_ids:
+                for user_id in offline_ids:
+                    _status_cache.pop(user_id, None)
+                logger.info(f"Marked {len(offline_ids)} inactive users as offline")
             
         except Exception as e:
             logger.error(f"Error updating offline users: {str(e)}")
\ No newline at end of file
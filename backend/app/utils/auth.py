@@ -5,51 +5,114 @@ from app.models.auth import TokenData
 from app.models.common import UserRole
 from app.models.user import User
 from app.services.auth.auth_service import AuthService
-from typing import List, Dict, Any, Optional
+from app.utils.logging import get_logger
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
 import time
 
+logger = get_logger(__name__)
+
 # Security scheme for Bearer token
 security = HTTPBearer()
 
 # PERFORMANCE FIX: Cache user profiles to avoid DB hit on every request
 class UserProfileCache:
-    def __init__(self, ttl_seconds: int = 60):
-        self._cache: Dict[str, User] = {}
-        self._timestamps: Dict[str, float] = {}
+    def __init__(self, ttl_seconds: int = 60, max_size: int = 10_000):
+        # {uid: (user, expires_at)} on the monotonic clock, oldest insert first
+        self._cache: Dict[str, Tuple[User, float]] = {}
         self._ttl = ttl_seconds
+        self._max_size = max_size
 
     def get(self, uid: str) -> Optional[User]:
-        if uid in self._cache:
-            if time.time() - self._timestamps[uid] < self._ttl:
-                return self._cache[uid]
-            else:
-                del self._cache[uid]
-                del self._timestamps[uid]
+        entry = self._cache.get(uid)
+        if entry is None:
+            return None
+        if time.monotonic() < entry[1]:
+            return entry[0]
+        del self._cache[uid]
         return None
 
     def set(self, uid: str, user: User):
-        self._cache[uid] = user
-        self._timestamps[uid] = time.time()
+        # Re-insert so dict order tracks age
+        self._cache.pop(uid, None)
+        if len(self._cache) >= self._max_size:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[uid] = (user, time.monotonic() + self._ttl)
 
     def invalidate(self, uid: str = None):
         if uid:
             self._cache.pop(uid, None)
-            self._timestamps.pop(uid, None)
         else:
             self._cache.clear()
-            self._timestamps.clear()
 
 # Global cache - 60 second TTL
 _user_cache = UserProfileCache(ttl_seconds=60)
 
+# PERFORMANCE: Cache verified tokens so repeat requests skip the RS256 check
+class TokenCache:
+    def __init__(self, ttl_seconds: int = 60, max_size: int = 10_000):
+        # {sha256(token): (decoded_token, expires_at)}, oldest first - raw JWTs are never stored
+        self._cache: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self._ttl = ttl_seconds
+        self._max_size = max_size
+
+    @staticmethod
+    def _key(id_token: str) -> bytes:
+        return hashlib.sha256(id_token.encode()).digest()
+
+    def get(self, id_token: str) -> Optional[dict]:
+        key = self._key(id_token)
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if time.time() < entry[1]:
+            return entry[0]
+        del self._cache[key]
+        return None
+
+    def set(self, id_token: str, decoded_token: dict):
+        # Never outlive the token itself
+        expires_at = min(decoded_token.get('exp', 0), time.time() + self._ttl)
+        key = self._key(id_token)
+        self._cache[key] = (decoded_token, expires_at)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+_token_cache = TokenCache(ttl_seconds=60)
+
+# Record a login at most this often per user; profile cache misses happen every minute
+LAST_LOGIN_UPDATE_INTERVAL_SECONDS = 300
+LAST_LOGIN_TRACK_MAX_USERS = 10_000
+# {uid: monotonic time of the last scheduled update}, oldest first
+_last_login_write: Dict[str, float] = {}
+
+def _should_update_last_login(uid: str) -> bool:
+    now = time.monotonic()
+    last_write = _last_login_write.get(uid)
+    if last_write is not None and now - last_write < LAST_LOGIN_UPDATE_INTERVAL_SECONDS:
+        return False
+    # Re-insert so dict order tracks age
+    _last_login_write.pop(uid, None)
+    if len(_last_login_write) >= LAST_LOGIN_TRACK_MAX_USERS:
+        _last_login_write.pop(next(iter(_last_login_write)))
+    _last_login_write[uid] = now
+    return True
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """Verify Firebase ID token and return user data"""
 
     # Extract token from Authorization header
     id_token = credentials.credentials
 
-    # Verify token with Firebase
-    decoded_token = FirebaseConfig.verify_id_token(id_token)
+    # Verify token with Firebase, unless it was verified moments ago
+    decoded_token = _token_cache.get(id_token)
+    if decoded_token is None:
+        decoded_token = FirebaseConfig.verify_id_token(id_token)
+        if decoded_token:
+            _token_cache.set(id_token, decoded_token)
 
     if not decoded_token:
         raise HTTPException(
@@ -73,9 +136,6 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if not user_profile:
         # Automatically create profile for existing Firebase users
         try:
-            from models.user import User
-            from models.common import UserRole
-
             auto_profile = User(
                 uid=uid,
                 email=email,
@@ -88,6 +148,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             user_profile = await auth_service.create_user_profile(auto_profile)
 
         except Exception as create_error:
+            logger.warning("Auto-creating profile for UID %s failed: %s", uid, create_error)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User profile not found for UID: {uid}. Please complete registration."
@@ -98,8 +159,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
     # Update last login in background (don't block response)
     # Only update occasionally, not every request
-    import asyncio
-    asyncio.create_task(auth_service.update_last_login(uid))
+    if _should_update_last_login(uid):
+        asyncio.create_task(auth_service.update_last_login(uid))
 
     return user_profile
 
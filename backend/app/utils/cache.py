@@ -0,0 +1,60 @@
+"""
+In-memory TTL cache shared by the service layer
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import time
+
+
+class TTLCache:
+    def __init__(self, ttl_seconds: int = 30, max_size: int = 10_000):
+        self._cache: Dict[str, Any] = {}
+        self._timestamps: Dict[str, float] = {}
+        self._ttl = ttl_seconds
+        self._max_size = max_size
+        # One in-flight load per key, so concurrent misses share a single fetch
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        timestamp = self._timestamps.get(key)
+        if timestamp is None:
+            return None
+        if time.time() - timestamp < self._ttl:
+            return self._cache[key]
+        # Expired - evict now rather than holding it until it is overwritten
+        self.invalidate(key)
+        return None
+
+    def set(self, key: str, value: Any):
+        # Re-insert so dict order stays oldest-first
+        self.invalidate(key)
+        if len(self._cache) >= self._max_size:
+            self.invalidate(next(iter(self._cache)))
+        self._cache[key] = value
+        self._timestamps[key] = time.time()
+
+    def invalidate(self, key: str):
+        self._cache.pop(key, None)
+        self._timestamps.pop(key, None)
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """Return the cached value, or load it once for all concurrent callers"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # Every waiter gets the same result (None included); shielded so one
+        # cancelled caller does not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        value = await loader()
+        if value is not None:
+            self.set(key, value)
+        return value
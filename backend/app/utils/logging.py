@@ -3,11 +3,30 @@ System Logging Utility
 Logs system activities to Firebase for admin dashboard
 """
 
+import atexit
 import logging
+import logging.handlers
+import queue
+from collections import Counter
 from datetime import datetime
 from app.core.firebase_config import FirebaseConfig
 
 
+# All loggers enqueue records; one background listener does the blocking stream writes
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_console_handler = logging.StreamHandler()
+_console_handler.setLevel(logging.INFO)
+_console_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+))
+_queue_listener = logging.handlers.QueueListener(_log_queue, _console_handler)
+_queue_listener.start()
+atexit.register(_queue_listener.stop)
+
+_sample_counts: Counter = Counter()
+
+
 def get_logger(name: str) -> logging.Logger:
     """
     Get a configured logger instance
@@ -24,21 +43,30 @@ def get_logger(name: str) -> logging.Logger:
     if not logger.handlers:
         logger.setLevel(logging.INFO)
         
-        # Console handler
-        handler = logging.StreamHandler()
+        # Queue handler - formatting and output happen on the listener thread
+        handler = logging.handlers.QueueHandler(_log_queue)
         handler.setLevel(logging.INFO)
         
-        # Formatter
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        handler.setFormatter(formatter)
-        
         logger.addHandler(handler)
     
     return logger
 
+def log_sampled(logger: logging.Logger, key: str, level: int, message: str, *args, every: int = 100, **kwargs):
+    """
+    Log the first occurrence of a repeating message and then every Nth one
+    
+    Args:
+        logger: Logger to write to
+        key: Identifies the repeating message (e.g. the call site)
+        level: Logging level
+        message: Message format string
+        every: Emit one record per this many occurrences
+    """
+    _sample_counts[key] += 1
+    count = _sample_counts[key]
+    if count == 1 or count % every == 0:
+        logger.log(level, message + " (occurrence %d)", *args, count, **kwargs)
+
 def log_system_activity(user_email: str, action: str, message: str, level: str = "info", ip_address: str = "127.0.0.1"):
     """
     Log system activity to Firebase
@@ -0,0 +1,17 @@
+"""
+Caches of users/{uid} data shared by the service layer
+The auth layer invalidates them when a profile or role changes
+"""
+
+from app.utils.cache import TTLCache
+
+user_cache = TTLCache(ttl_seconds=60)  # "user_{uid}" -> {'user_name', 'user_role'}
+missing_user_cache = TTLCache(ttl_seconds=15)  # user ids with no users/{uid} doc
+user_doc_cache = TTLCache(ttl_seconds=300)  # Raw users/{uid} docs for participant setup
+
+
+def invalidate_user_cache(user_id: str):
+    """Drop cached user data after a profile or role change"""
+    user_cache.invalidate(f"user_{user_id}")
+    user_doc_cache.invalidate(user_id)
+    missing_user_cache.invalidate(user_id)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Backfill Conversation Participants Script
+Copies conversation_participants records onto their conversation documents
+(participant_ids + participants) and fills in last_activity_at, so conversations
+created before these fields existed show up in user conversation lists. Members
+missing from an already-embedded list are appended.
+"""
+
+import sys
+import os
+
+# Add the parent directory to Python path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.firebase_config import FirebaseConfig
+
+
+def backfill_conversation_participants():
+    db = FirebaseConfig.get_firestore()
+    if not db:
+        print("Firestore is not available - check Firebase credentials")
+        return
+
+    conversations_collection = db.collection('conversations')
+    participants_collection = db.collection('conversation_participants')
+
+    # Group all participant records by conversation
+    participants_by_conversation = {}
+    for doc in participants_collection.stream():
+        data = doc.to_dict()
+        participants_by_conversation.setdefault(data.get('conversation_id'), []).append({
+            'user_id': data.get('user_id'),
+            'user_name': data.get('user_name'),
+            'user_role': data.get('user_role'),
+            'joined_at': data.get('joined_at'),
+            'is_active': data.get('is_active', True),
+            'last_read_at': data.get('last_read_at')
+        })
+
+    updated = 0
+    batch = db.batch()
+    pending_writes = 0
+    for doc in conversations_collection.stream():
+        data = doc.to_dict()
+        updates = {}
+        participants = participants_by_conversation.get(doc.id, [])
+        if 'participant_ids' not in data:
+            updates['participant_ids'] = [p['user_id'] for p in participants]
+            updates['participants'] = participants
+        else:
+            # Repair conversations where only later members were embedded
+            embedded_ids = set(data['participant_ids'])
+            missing = [p for p in participants if p['user_id'] not in embedded_ids]
+            if missing:
+                updates['participant_ids'] = data['participant_ids'] + [p['user_id'] for p in missing]
+                updates['participants'] = data.get('participants', []) + missing
+        if 'last_activity_at' not in data:
+            updates['last_activity_at'] = data.get('last_message_time') or data.get('created_at')
+        if not updates:
+            continue
+
+        batch.update(doc.reference, updates)
+        pending_writes += 1
+        updated += 1
+
+        # Firestore rejects batches with more than 500 writes
+        if pending_writes == 500:
+            batch.commit()
+            batch = db.batch()
+            pending_writes = 0
+
+    if pending_writes:
+        batch.commit()
+
+    print(f"Backfilled {updated} conversations")
+
+
+if __name__ == "__main__":
+    backfill_conversation_participants()
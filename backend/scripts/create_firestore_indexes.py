@@ -49,6 +49,50 @@ Please create them in the Firebase Console:
    - applicant_id (Ascending)
    - created_at (Descending)
 
+7. INCIDENTS COLLECTION - Resolved By Assignee Query
+   Collection: incidents
+   Fields:
+   - assigned_to (Ascending)
+   - status (Ascending)
+   - resolved_at (Descending)
+
+8. INCIDENTS COLLECTION - Resolved By Resolver Query
+   Collection: incidents
+   Fields:
+   - resolved_by (Ascending)
+   - status (Ascending)
+   - resolved_at (Descending)
+
+9. CONVERSATIONS COLLECTION - User Conversations Query
+   Collection: conversations
+   Fields:
+   - participant_ids (Array contains)
+   - last_activity_at (Descending)
+
+10. CONVERSATIONS COLLECTION - User Conversations By Type Query
+   Collection: conversations
+   Fields:
+   - participant_ids (Array contains)
+   - conversation_type (Ascending)
+   - last_activity_at (Descending)
+
+11. SECURITY_APPLICATIONS COLLECTION - Pending Application Check
+   Collection: security_applications
+   Fields:
+   - applicant_uid (Ascending)
+   - status (Ascending)
+
+12. USER_STATUS COLLECTION - Offline Sweep Query
+   Collection: user_status
+   Fields:
+   - is_online (Ascending)
+   - last_activity (Ascending)
+
+TTL POLICY - User Activity Retention
+   Collection group: user_activities
+   Field: expire_at
+   gcloud firestore fields ttls update expire_at --collection-group=user_activities --enable-ttl
+
 To create these indexes:
 1. Go to your Firebase Console
 2. Navigate to Firestore Database > Indexes